@@ -1,15 +1,21 @@
 import pandas as pd
 import os
+import sys
 
 # Get the current directory of the script
 current_dir = os.path.dirname(os.path.abspath(__file__))
 file_path = os.path.join(current_dir, 'clean.csv')
 
-# Load the CSV file
-df = pd.read_csv(file_path)
+# Use the transaction schema of the pipeline
+sys.path.append(os.path.join(current_dir, '..', 'Transaction-Pipeline'))
+from transaction_schema import read_transactions, write_transactions, derive_date_columns
 
-# Split the Date field into Day
-df['Day'] = df['Date'].str.split('/', expand=True)[1]
+# Load the CSV file with the typed columns
+df = read_transactions(file_path)
+
+# Derive the Day from the parsed Date, zero padded like in the Date field
+df = derive_date_columns(df, day=True)
+df['Day'] = df['Day'].astype(str).str.zfill(2)
 
 # Add a column ID with a unique id for each record
 df['ID'] = range(1, len(df) + 1)
@@ -21,6 +27,6 @@ df = df[~df['Category'].isin(['transfer', 'expense'])]
 df = df[['ID', 'Year', 'Month', 'Day', 'Date', 'Description', 'Category', 'Amount', 'Type', 'Bank', 'Card']]
 
 # Save the modified CSV file
-df.to_csv(os.path.join(current_dir, 'clean_modified.csv'), index=False)
+write_transactions(df, os.path.join(current_dir, 'clean_modified.csv'))
 
 print("Complete")
\ No newline at end of file
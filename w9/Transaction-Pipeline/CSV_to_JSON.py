@@ -3,18 +3,24 @@ Author: Adrien Protzel
 
 This script converts a CSV file to a JSON file and then removes the original CSV file.
 
+The streaming mode writes newline-delimited JSON (one record per line) in chunks, so large
+files convert in constant memory and without the indentation.
+
 Modules used:
 - csv: For reading the CSV file.
 - json: For writing the JSON file.
 - os: For interacting with the operating system.
+- itertools: For reading the rows in chunks.
 
 Functions:
 - csv_to_json(csv_file_path, json_file_path): Converts a CSV file to a JSON file and removes the original CSV file.
+- csv_to_ndjson(csv_file_path, json_file_path, chunk_size): Streams a CSV file to a newline-delimited JSON file and removes the original CSV file.
 """
 
 import csv
 import json
 import os
+from itertools import islice
 
 def csv_to_json(csv_file_path, json_file_path):
     """Convert a CSV file to a JSON file and remove the original CSV file."""
@@ -31,6 +37,24 @@ def csv_to_json(csv_file_path, json_file_path):
     # Remove the old CSV file
     os.remove(csv_file_path)
 
+def csv_to_ndjson(csv_file_path, json_file_path, chunk_size=10000):
+    """
+    Stream a CSV file to a newline-delimited JSON file and remove the original CSV file.
+
+    Args:
+        csv_file_path (str): Path to the CSV file.
+        json_file_path (str): Path to the NDJSON file.
+        chunk_size (int): Number of rows converted at a time.
+    """
+    with open(csv_file_path, mode='r', encoding='utf-8') as csv_file, \
+            open(json_file_path, mode='w', encoding='utf-8') as json_file:
+        csv_reader = csv.DictReader(csv_file)
+        for chunk in iter(lambda: list(islice(csv_reader, chunk_size)), []):
+            json_file.write(''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in chunk))
+
+    # Remove the old CSV file
+    os.remove(csv_file_path)
+
 # # Specify the file paths
 # csv_file_path = os.path.join(os.path.dirname(__file__), 'Data', 'clean.csv')
 # json_file_path = os.path.join(os.path.dirname(__file__), 'Data', 'clean.json')
@@ -3,18 +3,33 @@ Author: Adrien Protzel
 
 This script converts a JSON file to a CSV file and then removes the original JSON file.
 
+The streaming mode reads newline-delimited JSON (one record per line) or a JSON array one record
+at a time and writes the CSV in chunks, so large exports convert in constant memory.
+
 Modules used:
 - csv: For writing the CSV file.
 - json: For reading the JSON file.
 - os: For interacting with the operating system.
+- re: For skipping the separators between the records of a JSON array and finding numbers cut off by a read.
+- itertools: For writing the rows in chunks.
 
 Functions:
 - json_to_csv(json_file_path, csv_file_path): Converts a JSON file to a CSV file and removes the original JSON file.
+- iter_json_records(json_file_path): Yields the records of an NDJSON file or JSON array one at a time.
+- ndjson_to_csv(json_file_path, csv_file_path, chunk_size): Streams a JSON file to a CSV file and removes the original JSON file.
 """
 
 import csv
 import json
 import os
+import re
+from itertools import islice
+
+# Whitespace and commas between the records of a JSON array
+ARRAY_SEPARATORS = re.compile(r'[\s,]*')
+
+# Characters that can continue a number
+NUMBER_CHARACTERS = re.compile(r'[\d.eE+-]*')
 
 def json_to_csv(json_file_path, csv_file_path):
     """
@@ -41,6 +56,85 @@ def json_to_csv(json_file_path, csv_file_path):
     # Remove the old JSON file
     os.remove(json_file_path)
 
+def iter_json_array(json_file, read_size=1 << 16):
+    """Yield the records of a JSON array from an open file, decoding one record at a time."""
+    decoder = json.JSONDecoder()
+    buffer = json_file.read(read_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array")
+    position = 1
+    exhausted = False
+
+    while True:
+        position = ARRAY_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError("Need more data")
+            record, end = decoder.raw_decode(buffer, position)
+            # A number cut off by the end of the buffer may go on in the next block, e.g. 123 of 12345678 or 1.5 of 1.5e10
+            if NUMBER_CHARACTERS.match(buffer, end).end() == len(buffer) and not exhausted:
+                raise ValueError("Need more data")
+        except ValueError:
+            # The record continues past the end of the buffer, read the next block
+            if exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            block = json_file.read(read_size)
+            exhausted = not block
+            buffer = buffer[position:] + block
+            position = 0
+            continue
+        position = end
+        yield record
+
+def iter_json_records(json_file_path):
+    """
+    Yield the records of a JSON file one at a time.
+
+    Files starting with '[' are read as a JSON array, anything else as newline-delimited JSON.
+
+    Args:
+        json_file_path (str): Path to the JSON file.
+    """
+    with open(json_file_path, mode='r', encoding='utf-8') as json_file:
+        is_array = json_file.read(1024).lstrip().startswith('[')
+        json_file.seek(0)
+
+        if is_array:
+            yield from iter_json_array(json_file)
+        else:
+            for line in json_file:
+                if line.strip():
+                    yield json.loads(line)
+
+def ndjson_to_csv(json_file_path, csv_file_path, chunk_size=10000):
+    """
+    Stream a JSON file to a CSV file and remove the original JSON file.
+
+    The header is the union of the keys of all records, in order of first appearance.
+
+    Args:
+        json_file_path (str): Path to the NDJSON or JSON array file.
+        csv_file_path (str): Path to the CSV file.
+        chunk_size (int): Number of rows written at a time.
+    """
+    # First pass to collect the keys of every record for the header
+    header = {}
+    for record in iter_json_records(json_file_path):
+        header.update(dict.fromkeys(record))
+
+    # Second pass to write the rows in chunks
+    records = iter_json_records(json_file_path)
+    with open(csv_file_path, mode='w', encoding='utf-8', newline='') as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=list(header))
+        csv_writer.writeheader()
+        for chunk in iter(lambda: list(islice(records, chunk_size)), []):
+            csv_writer.writerows(chunk)
+
+    # Remove the old JSON file
+    os.remove(json_file_path)
+
 # # Specify the file paths
 # json_file_path = 'Data/clean.json'
 # csv_file_path = 'Data/clean.csv'
@@ -5,22 +5,39 @@ This script creates a GUI application using Tkinter to manually clean up bad lin
 It reads bad lines from a specified file, displays them in a pop-up window, and allows the user
 to manually enter the correct information. The corrected data is then written to a CSV file.
 
+Before any window is shown, bad lines caused by commas inside the description (like the quotes in
+BofA Zelle memos) are repaired automatically using the add_header of the account in config.json.
+Only the lines that cannot be repaired are shown to the user.
+
 Modules used:
 - tkinter: For creating the GUI.
 - tkinterdnd2: For drag-and-drop functionality in Tkinter.
 - pathlib: For handling file paths.
 - csv: For reading and writing CSV files.
 - os: For interacting with the operating system.
+- ast: For reading the rows written to the bad lines file.
+- re: For checking the Amount field.
+- datetime: For checking the Date field.
+- pandas: For parsing and formatting the amounts.
 """
 
-import tkinter as tk
-from tkinterdnd2 import TkinterDnD
 from pathlib import Path
+from datetime import datetime
+import ast
 import csv
 import os
+import re
+import pandas as pd
+from instrumentation import stage, count
+from config_registry import get_registry, as_registry
+from transaction_schema import CLEAN_HEADER, parse_amounts, format_amounts
+from stage_journal import atomic_write
 
 # Define the desired column order
-HEADER = ["Year", "Month", "Date", "Description", "Category", "Amount", "Type", "Bank", "Card"]
+HEADER = CLEAN_HEADER
+
+# An amount as written in the bank exports, e.g. -1,301.03 or $25.00
+AMOUNT_PATTERN = re.compile(r'^-?\$?-?[\d,]*\.?\d+$')
 
 def read_bad_lines(file_path):
     """Read bad lines from the specified file."""
@@ -43,8 +60,106 @@ def parse_filepath(filepath):
     else:
         return None, None, None
 
-def create_popup(root, line, next_line_callback, cancel_callback):
-    """Create a pop-up window to display the bad line."""
+def parse_bad_line(line):
+    """Split a line of the bad lines file into the file path and the row fields."""
+    if ': [' not in line:
+        return None, None
+    filepath, fields = line.split(': [', 1)
+    try:
+        return filepath, ast.literal_eval('[' + fields.strip())
+    except (ValueError, SyntaxError):
+        return filepath, None
+
+def repair_bad_line(line, configs):
+    """
+    Repair a bad line whose description was split into extra fields by commas.
+
+    The fields before the description and the fields after it are matched with the account's
+    add_header from each end of the row, and the overflow in the middle is joined back into
+    the description. The repair is only accepted if the Date and Amount fields parse cleanly.
+
+    Args:
+        line (str): The line from the bad lines file.
+        configs (ConfigRegistry): Configuration entries from config.json.
+
+    Returns:
+        list: The repaired row in HEADER order, or None if the line cannot be repaired.
+    """
+    filepath, fields = parse_bad_line(line)
+    if fields is None:
+        return None
+
+    # Find the account configuration from the folder name
+    type_, bank, card = parse_filepath(filepath)
+    config = configs.account(type_, bank, card)
+    if config is None or 'add_header' not in config:
+        return None
+    add_header = config['add_header']
+    if add_header.count("Description") != 1 or len(fields) <= len(add_header):
+        return None
+
+    # Match the columns before the description from the start and the ones after it from the end
+    start = add_header.index("Description")
+    end = len(fields) - (len(add_header) - start - 1)
+    values = dict(zip(add_header[:start], fields[:start]))
+    values.update(zip(add_header[start + 1:], fields[end:]))
+    values["Description"] = ','.join(fields[start:end])
+
+    # Only accept the repair if the Date and Amount are valid
+    date = values.get("Date", "").strip()
+    amount = values.get("Amount", "").strip()
+    try:
+        datetime.strptime(date, '%m/%d/%Y')
+    except ValueError:
+        return None
+    cents = parse_amounts(pd.Series([amount]))[0] if AMOUNT_PATTERN.match(amount) else pd.NA
+    if pd.isna(cents):
+        return None
+
+    row = {"Date": date, "Description": values["Description"], "Amount": int(cents),
+           "Type": type_, "Bank": bank, "Card": card}
+    return [row.get(col, "") for col in HEADER]
+
+def repair_bad_lines(bad_lines, configs):
+    """
+    Repair every bad line that can be repaired automatically.
+
+    Returns:
+        tuple: The repaired rows in HEADER order and the lines that still need manual entry.
+    """
+    configs = as_registry(configs)
+    rows = []
+    remaining = []
+    for line in bad_lines:
+        row = repair_bad_line(line, configs)
+        if row is not None:
+            rows.append(row)
+        elif line.strip():
+            remaining.append(line)
+    return rows, remaining
+
+def entry_cents(amount, cents):
+    """
+    Combine the dollars and cents entered in the pop-up window into an amount in cents.
+
+    Args:
+        amount (str): Whole dollars, with a leading minus for negative amounts.
+        cents (str): Cents, e.g. 5 for 0.05.
+
+    Returns:
+        int: The amount in cents, or None if the fields are not numbers.
+    """
+    amount, cents = amount.strip(), cents.strip()
+    try:
+        total = abs(int(amount or 0)) * 100 + int(cents or 0)
+    except ValueError:
+        return None
+    return -total if amount.startswith('-') else total
+
+def create_popup(root, line, rows, next_line_callback, cancel_callback):
+    """Create a pop-up window to display the bad line and collect the corrected row into rows."""
+    import tkinter as tk
+
     popup = tk.Toplevel(root)
     popup.title("Manual Entry for Bad Lines")
     center_window(popup, width=800, height=600)  # Center the window on the screen
@@ -119,7 +234,7 @@ def create_popup(root, line, next_line_callback, cancel_callback):
         return value
 
     def on_enter():
-        """Collect input data and write it to a CSV file."""
+        """Collect input data and add it to the corrected rows."""
         # Clean and merge date inputs
         month, day, year_var = entries["Date"]
         month = clean_date_input(month, 2)
@@ -134,18 +249,13 @@ def create_popup(root, line, next_line_callback, cancel_callback):
                 input_data.append(date)
             elif col == "Amount":
                 amount, cents = entries["Amount"]
-                amount = amount.get()
-                cents = cents.get().zfill(2)
-                input_data.append(f"{amount}.{cents}")
+                input_data.append(entry_cents(amount.get(), cents.get()))
             elif col in entries:
                 input_data.append(entries[col].get())
             else:
                 input_data.append("")
 
-        # Write the input data to dirty.csv as a comma-separated list
-        with open(os.path.join(current_dir, 'Data', 'dirty.csv'), 'a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(input_data)
+        rows.append(input_data)
 
         popup.destroy()
         next_line_callback()
@@ -164,29 +274,104 @@ def create_popup(root, line, next_line_callback, cancel_callback):
     cancel_button = tk.Button(button_frame, text="Cancel", command=on_cancel)
     cancel_button.pack(side='left', padx=10)
 
-# Initialize main window
-root = TkinterDnD.Tk()
-root.withdraw()  # Hide the root window
-root.title("Bad Lines Cleaner")
-center_window(root, width=400, height=300)  # Center the window on the screen
-
-# Read bad lines and create pop-up windows
-current_dir = Path(__file__).parent
-bad_lines_path = current_dir / 'Data' / 'bad_lines.txt'
-bad_lines = read_bad_lines(bad_lines_path)
-
-def show_next_line(index=0):
-    """Display the next bad line in a pop-up window."""
-    if index < len(bad_lines):
-        create_popup(root, bad_lines[index], lambda: show_next_line(index + 1), lambda: root.destroy())
-    else:
-        remove_bad_lines_file()
-        root.destroy()
+def pending_path(bad_lines_path):
+    """Return the path of the bad lines still left by a run whose result is not saved yet."""
+    return bad_lines_path.with_suffix('.pending')
+
+def save_bad_lines(file_path, lines, remove_empty=True):
+    """Write the bad lines still left to a file through a temporary file, or remove the file if none are left."""
+    if not lines and remove_empty:
+        if file_path.exists():
+            os.remove(file_path)
+        return
+    with atomic_write(file_path) as temp_path:
+        with open(temp_path, 'w') as file:
+            file.writelines(lines)
+
+def commit_bad_lines(bad_lines_path):
+    """
+    Replace the bad lines file with the lines left by the run, once its rows are saved in the stage journal.
+
+    Args:
+        bad_lines_path (Path): Path to the bad lines log file.
+    """
+    pending = pending_path(bad_lines_path)
+    if pending.exists():
+        os.replace(pending, bad_lines_path)
+        if os.path.getsize(bad_lines_path) == 0:
+            os.remove(bad_lines_path)
+
+@stage("bad_lines_cleaner")
+def clean_bad_lines(bad_lines_path, configs, interactive=True, update_file=True):
+    """
+    Repair the bad lines automatically where possible and show the rest in pop-up windows.
+
+    The lines that are neither repaired nor entered are kept for the next run. They are written
+    before any window is shown and again when the windows are closed, so lines that were
+    repaired or entered are never read again.
+
+    Args:
+        bad_lines_path (Path): Path to the bad lines log file.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        interactive (bool): Show the pop-up windows. Otherwise the lines that need manual entry
+            are kept in the bad lines file for the next interactive run.
+        update_file (bool): Rewrite the bad lines file. Otherwise the lines left are written next
+            to it and main.py applies them with commit_bad_lines once the result of the stage is
+            saved in the stage journal, so a run that fails before then reads them all again.
+
+    Returns:
+        list: Corrected rows in HEADER order.
+    """
+    if not bad_lines_path.exists():
+        return []
+    rows, bad_lines = repair_bad_lines(read_bad_lines(bad_lines_path), configs)
+    count("bad_lines_repaired", len(rows))
+    count("bad_lines_manual", len(bad_lines))
+
+    # Keep only the lines that still need manual entry, an empty pending file removes the bad lines file
+    target_path = bad_lines_path if update_file else pending_path(bad_lines_path)
+    save_bad_lines(target_path, bad_lines, remove_empty=update_file)
+
+    # Without a desktop session, or with nothing left to enter, no window is shown
+    if not interactive or not bad_lines:
+        return rows
+
+    # Tk is only imported once a window is shown, so the pipeline also runs on a server without it
+    from tkinterdnd2 import TkinterDnD
+
+    # Initialize main window
+    root = TkinterDnD.Tk()
+    root.withdraw()  # Hide the root window
+    root.title("Bad Lines Cleaner")
+    center_window(root, width=400, height=300)  # Center the window on the screen
+
+    def show_next_line(index=0):
+        """Display the next bad line in a pop-up window."""
+        if index < len(bad_lines):
+            create_popup(root, bad_lines[index], rows, lambda: show_next_line(index + 1), lambda: root.destroy())
+        else:
+            root.destroy()
+
+    repaired = len(rows)
+    show_next_line()
+    root.mainloop()
+
+    # The lines are entered in order, a cancelled window leaves the lines from the cancelled one on
+    save_bad_lines(target_path, bad_lines[len(rows) - repaired:], remove_empty=update_file)
+    return rows
+
+def main():
+    """Append the corrected bad lines to dirty.csv."""
+    current_dir = Path(__file__).parent
+    configs = get_registry(current_dir / 'Configs' / 'config.json')
+    rows = clean_bad_lines(current_dir / 'Data' / 'bad_lines.txt', configs)
 
-def remove_bad_lines_file():
-    """Remove the bad lines file after processing."""
-    if bad_lines_path.exists():
-        os.remove(bad_lines_path)
+    # Write the input data to dirty.csv as a comma-separated list, with the amounts in dollars
+    rows = pd.DataFrame(rows, columns=HEADER).astype({'Amount': 'Int64'})
+    rows['Amount'] = format_amounts(rows['Amount'])
+    with open(current_dir / 'Data' / 'dirty.csv', 'a', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerows(rows.itertuples(index=False))
 
-show_next_line()
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
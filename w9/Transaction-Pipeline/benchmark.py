@@ -0,0 +1,272 @@
+"""
+Author: Adrien Protzel
+
+This script benchmarks the pipeline stages on synthetic bank statements so changes in speed or
+memory use show up between versions.
+
+For every size it generates statements for each account in Configs/config.json, with the
+account's remove_rows preamble and add_header column order, and descriptions drawn from the keys
+of the description map. It then runs the merging and cleaning stages in a temporary folder,
+recording the wall time, CPU time and peak memory of each stage. Only descriptions that the
+description and category maps resolve automatically are used, so no window is ever shown.
+
+Tracing the allocations slows the stages several times over, so the stages run twice on copies of
+the same statements: once untraced for the wall and CPU times, and once traced for the peak memory.
+
+The results are saved as JSON in the Benchmarks folder.
+
+Usage:
+    python benchmark.py                      # 10k, 1M and 10M rows
+    python benchmark.py --sizes 10000 100000
+
+Modules used:
+- argparse: For reading the command line options.
+- csv: For writing the synthetic statements.
+- json: For writing the results.
+- os: For interacting with the operating system.
+- random: For generating the synthetic transactions.
+- shutil: For copying the statements of each pass.
+- subprocess: For recording the git commit of the benchmarked version.
+- tempfile: For the temporary Data folder.
+- time: For timing the stages.
+- tracemalloc: For measuring the peak memory of the stages.
+- pandas: For the version of the results.
+
+Functions:
+- description_pool(): Returns the descriptions that are resolved without any manual input.
+- generate_statements(data_dir, configs, rows, pool, rows_per_file, seed): Writes synthetic statements for every account.
+- measure(function, *args): Runs a stage and returns its result, wall time and CPU time.
+- measure_memory(function, *args): Runs a stage with its allocations traced and returns its result and peak memory.
+- run_stages(data_dir, configs, measure_stage): Runs the merging and cleaning stages, measuring each with measure_stage.
+- run_benchmark(rows, configs, pool): Generates and runs the pipeline on the given number of rows.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+import pandas as pd
+import file_merger
+import file_cleaner
+import desc_cleaner
+import cat_cleaner
+from map_store import DESCRIPTION_MAP, CATEGORY_MAP, get_keyword_map
+from config_registry import get_registry
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Number of rows of the default benchmark sizes
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+# Suffixes added to the merchant keys, like the store numbers and locations in real exports
+DESCRIPTION_SUFFIXES = ["", " #0319", " 866-712-7753 CA", " PORTLAND OR", " ONLINE PMT 48213"]
+
+def description_pool():
+    """Return the statement descriptions that both maps resolve without any manual input."""
+    description_map = get_keyword_map(DESCRIPTION_MAP)
+    category_map = get_keyword_map(CATEGORY_MAP)
+
+    pool = []
+    for keyphrase in description_map.keywords:
+        for suffix in DESCRIPTION_SUFFIXES:
+            description = f"{keyphrase}{suffix}".upper()
+            mapped_description = description_map.lookup(description.lower(), match_values=True)
+            if mapped_description is not None and category_map.lookup(mapped_description) is not None:
+                pool.append(description)
+    return pool
+
+def statement_row(add_header, day, description, amount, reference):
+    """Build a statement row in the column order of the account's add_header."""
+    row = []
+    for column in add_header:
+        if column == "Date":
+            row.append(day.strftime('%m/%d/%Y'))
+        elif column == "Description":
+            row.append(description)
+        elif column == "Amount":
+            row.append(f"{amount:.2f}")
+        else:
+            row.append(reference)
+    return row
+
+def generate_statements(data_dir, configs, rows, pool, rows_per_file=100_000, seed=512):
+    """
+    Write synthetic statements for every account into Data/<Type>_<Bank>_<Card>.
+
+    Args:
+        data_dir (Path): Path to the Data folder.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        rows (int): Total number of transactions, split evenly over the accounts.
+        pool (list): Descriptions to draw from.
+        rows_per_file (int): Largest number of transactions in one statement file.
+        seed (int): Seed of the random generator, so every run generates the same data.
+    """
+    generator = random.Random(seed)
+    first_day = date(2023, 1, 1)
+
+    for index, config in enumerate(configs):
+        account = f"{config['type']}_{config['bank']}_{config['card']}"
+        account_dir = data_dir / account
+        account_dir.mkdir(parents=True)
+        account_rows = rows // len(configs) + (1 if index < rows % len(configs) else 0)
+        header = [column if column != "*" else f"Column {i}" for i, column in enumerate(config['add_header'])]
+
+        for file_index, start in enumerate(range(0, account_rows, rows_per_file)):
+            count = min(rows_per_file, account_rows - start)
+            with open(account_dir / f"statement_{file_index}.csv", 'w', newline='') as f:
+                # Preamble removed by file_merger.py, with the bank's own header as its last line
+                for line in range(config['remove_rows'] - 1):
+                    f.write(f"Summary line {line},,\n")
+                if config['remove_rows'] > 0:
+                    f.write(','.join(header) + '\n')
+
+                writer = csv.writer(f)
+                descriptions = generator.choices(pool, k=count)
+                for description in descriptions:
+                    day = first_day + timedelta(days=generator.randrange(800))
+                    amount = round(generator.uniform(-500, 500), 2)
+                    writer.writerow(statement_row(config['add_header'], day, description, amount, str(generator.randrange(10 ** 8))))
+
+def measure(function, *args):
+    """
+    Run a stage and time it.
+
+    Returns:
+        tuple: The result of the stage and a dictionary with its wall time and CPU time.
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    result = function(*args)
+    cpu_seconds = time.process_time() - start_cpu
+    wall_seconds = time.perf_counter() - start_wall
+    return result, {
+        "wall_seconds": round(wall_seconds, 4),
+        "cpu_seconds": round(cpu_seconds, 4),
+    }
+
+def measure_memory(function, *args):
+    """
+    Run a stage with its allocations traced, which slows it down, so it is not timed.
+
+    Returns:
+        tuple: The result of the stage and a dictionary with its peak memory.
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {"peak_memory_mb": round(peak / 2 ** 20, 2)}
+
+def run_stages(data_dir, configs, measure_stage):
+    """
+    Run the merging and cleaning stages on a Data folder.
+
+    Args:
+        data_dir (Path): Path to the Data folder with the statements.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        measure_stage (function): measure or measure_memory.
+
+    Returns:
+        tuple: The clean transactions and the measurements of every stage.
+    """
+    # Merge stage runs its workers in other processes, so only the parent's memory is traced
+    stages = {}
+    _, stages["file_merger"] = measure_stage(file_merger.merge_accounts, data_dir, configs)
+    df, stages["file_cleaner"] = measure_stage(file_cleaner.clean_files, str(data_dir), configs)
+    df, stages["desc_cleaner"] = measure_stage(desc_cleaner.clean_descriptions, df)
+    df, stages["cat_cleaner"] = measure_stage(cat_cleaner.categorize_descriptions, df)
+    _, stages["write_clean_file"] = measure_stage(file_cleaner.write_clean_file, df, str(data_dir))
+    return df, stages
+
+def run_benchmark(rows, configs, pool):
+    """
+    Generate the statements and run the pipeline stages on them in a temporary folder.
+
+    The stages are timed on one copy of the statements and traced on another, since the stages
+    remove the statements they merge.
+
+    Args:
+        rows (int): Total number of transactions.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        pool (list): Descriptions to draw from.
+
+    Returns:
+        dict: The measurements of every stage.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        statements_dir = Path(temp_dir) / 'Statements'
+        start = time.perf_counter()
+        generate_statements(statements_dir, configs, rows, pool)
+        generate_seconds = round(time.perf_counter() - start, 4)
+        input_bytes = sum(f.stat().st_size for f in statements_dir.rglob('*.csv'))
+
+        timed_dir = Path(temp_dir) / 'Timed' / 'Data'
+        traced_dir = Path(temp_dir) / 'Traced' / 'Data'
+        shutil.copytree(statements_dir, timed_dir)
+        shutil.move(statements_dir, traced_dir)
+
+        df, stages = run_stages(timed_dir, configs, measure)
+        _, memory = run_stages(traced_dir, configs, measure_memory)
+        for name, measurements in memory.items():
+            stages[name].update(measurements)
+
+        return {
+            "rows": rows,
+            "clean_rows": len(df),
+            "input_mb": round(input_bytes / 2 ** 20, 2),
+            "generate_seconds": generate_seconds,
+            "stages": stages,
+            "total_wall_seconds": round(sum(stage["wall_seconds"] for stage in stages.values()), 4),
+        }
+
+def git_commit():
+    """Return the git commit of the benchmarked version, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=current_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    """Run the benchmark for every size and save the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the Transaction-Pipeline stages on synthetic statements.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of rows to benchmark.")
+    parser.add_argument('--output', default=os.path.join(current_dir, 'Benchmarks'), help="Folder for the results.")
+    args = parser.parse_args()
+
+    configs = get_registry(os.path.join(current_dir, 'Configs', 'config.json'))
+    pool = description_pool()
+
+    results = []
+    for rows in args.sizes:
+        result = run_benchmark(rows, configs, pool)
+        print(f"{rows} rows......{result['total_wall_seconds']}s")
+        results.append(result)
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(args.output, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
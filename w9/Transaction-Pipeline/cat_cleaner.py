@@ -3,118 +3,104 @@ Author: Adrien Protzel
 
 This script processes a CSV file to categorize transaction descriptions.
 It uses a predefined category map to automatically categorize descriptions.
-If a description does not match any category, a manual input window is displayed
-to allow the user to categorize the transaction.
+Descriptions that do not match any category are added to the review queue, where the
+user can categorize all of them in a single review window.
 
 Modules used:
+- numpy: For broadcasting the categories back to every row.
 - pandas: For data manipulation and analysis.
-- tkinter: For creating the GUI.
 - os: For interacting with the operating system.
 
 Functions:
-- load_category_map(): Loads the category map from a file.
-- check_description(row): Checks the description against the category map and
-  displays a manual input window if no match is found.
+- load_category_map(): Loads the category map from the map store.
+- map_category(description): Looks up a description in the compiled category map, memoized for the run.
+- categorize_descriptions(df, queue): Fills in the Category column of a dataframe, resolving each unique description once,
+  and queues the unmatched ones for review.
 """
 
+import numpy as np
 import pandas as pd
-import tkinter as tk
 import os
+from map_store import CATEGORY_MAP, load_rules, get_keyword_map
+from instrumentation import stage, count
+from transaction_schema import read_transactions, write_transactions
+from review_queue import ReviewQueue
 
-# Load the CSV file
 current_dir = os.path.dirname(os.path.abspath(__file__))
-csv_file_path = os.path.join(current_dir, 'Data', 'dirty.csv')
-df = pd.read_csv(csv_file_path)
 
-# Ensure the 'Description' column is of type string and convert to lowercase
-df['Description'] = df['Description'].astype(str).str.lower()
+# Categories already resolved during this run, cleared whenever the category map is recompiled
+category_cache = {}
+category_cache_map = None
 
 def load_category_map():
-    """Load the category map file."""
-    category_map_file_path = os.path.join(current_dir, 'Configs', 'Maps', 'category_map.txt')
-    category_map = {}
-    with open(category_map_file_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split(',')
-            if len(parts) == 2:
-                category_map[parts[0]] = parts[1]
-    return category_map
-
-def check_description(row):
-    """Check descriptions based on the mapping."""
-    category_map = load_category_map()
-    description = row['Description']
-    for keyword, mapped_category in category_map.items():
-        if keyword in description:
-            return mapped_category
-    
-    # If no mapping is found, show a popup window with the current description
-    def cancel():
-        root.destroy()
-        raise SystemExit
-
-    def skip():
-        root.destroy()
-
-    def add_mapping(category):
-        with open(os.path.join(current_dir, 'Configs', 'Maps', 'category_map.txt'), 'a') as f:
-            f.write(f"{description},{category.lower()}\n")
-        root.destroy()
-
-    root = tk.Tk()
-    root.title("Manual Category Mapping")
-
-    def center_window(window, width, height):
-        """Center the window on the screen."""
-        window.update_idletasks()
-        x = (window.winfo_screenwidth() // 2) - (width // 2)
-        y = (window.winfo_screenheight() // 2) - (height // 2)
-        window.geometry(f'{width}x{height}+{x}+{y}')
-
-    # Make the window smaller
-    center_window(root, width=400, height=300)
-
-    info_label = tk.Label(root, text=f"{row['Date']}: {row['Card']}: {row['Amount']}")
-    info_label.pack(pady=5)
-
-    description_label = tk.Label(root, text=f"Description: {description}", wraplength=380)
-    description_label.pack(pady=10)
-
-    category_buttons_frame1 = tk.Frame(root)
-    category_buttons_frame1.pack(pady=5)
-
-    category_buttons_frame2 = tk.Frame(root)
-    category_buttons_frame2.pack(pady=5)
-
-    categories1 = ["Grocery", "Dining", "Shopping", "Expense"]
-    categories2 = ["Subscription", "Utility", "Travel", "Gas", "Transfer"]
-    
-    for category in categories1:
-        button = tk.Button(category_buttons_frame1, text=category, command=lambda c=category: add_mapping(c))
-        button.pack(side=tk.LEFT, padx=5)
-
-    for category in categories2:
-        button = tk.Button(category_buttons_frame2, text=category, command=lambda c=category: add_mapping(c))
-        button.pack(side=tk.LEFT, padx=5)
-
-    button_frame = tk.Frame(root)
-    button_frame.pack(pady=10)
-
-    cancel_button = tk.Button(button_frame, text="Cancel", command=cancel)
-    cancel_button.grid(row=0, column=0, padx=(0, 20))  # Add space between Cancel and Skip button
-
-    skip_button = tk.Button(button_frame, text="Skip", command=skip)
-    skip_button.grid(row=0, column=1)  # Add space between Skip and Enter button
-
-    root.mainloop()
-
-    return description
-
-df['Category'] = df.apply(check_description, axis=1)
-
-# Save the modified DataFrame back to a new CSV file
-new_csv_file_path = os.path.join(current_dir, 'Data', 'clean.csv')
-df.to_csv(new_csv_file_path, index=False)
-
-# Remove the original file after saving the new one
-os.remove(csv_file_path)
\ No newline at end of file
+    """Load the category map from the map store."""
+    return load_rules(CATEGORY_MAP)
+
+def map_category(description):
+    """
+    Look up a description in the compiled category map, the first keyword in file order wins.
+
+    Returns:
+        str: The mapped category, or None if no keyword matches.
+    """
+    global category_cache_map
+    category_map = get_keyword_map(CATEGORY_MAP)
+    if category_map is not category_cache_map:
+        category_cache.clear()
+        category_cache_map = category_map
+    if description not in category_cache:
+        category_cache[description] = category_map.lookup(description)
+    return category_cache[description]
+
+@stage("cat_cleaner")
+def categorize_descriptions(df, queue=None):
+    """
+    Fill in the Category column of the dataframe based on the mapping, resolving each unique description once.
+
+    Descriptions without a match are added to the review queue and left without a category until
+    they are reviewed. Without a queue, they are reviewed right away in a single review window.
+
+    Args:
+        df (DataFrame): The transactions.
+        queue (ReviewQueue): The review queue of the run, or None to review the unmatched descriptions here.
+
+    Returns:
+        DataFrame: The transactions with the Category column.
+    """
+    # Ensure the 'Description' column is of type string and convert to lowercase
+    df['Description'] = df['Description'].astype(str).str.lower()
+
+    # Resolve every unique description once, codes are numbered in order of first appearance
+    codes, descriptions = pd.factorize(df['Description'])
+    categories = np.array([map_category(description) for description in descriptions], dtype=object)
+
+    unmatched = np.flatnonzero(pd.isna(categories))
+    count("uncategorized_descriptions", len(unmatched))
+    count("uncategorized_rows", np.isin(codes, unmatched).sum())
+
+    # Broadcast the categories back to every row
+    df['Category'] = pd.Series(categories.take(codes), index=df.index, dtype='category')
+
+    review = queue is None
+    if review:
+        queue = ReviewQueue()
+    queue.add_categories(df[df['Category'].isna()])
+    return queue.review(df) if review else df
+
+def main():
+    """Categorize dirty.csv and save it as clean.csv."""
+    # Load the CSV file
+    csv_file_path = os.path.join(current_dir, 'Data', 'dirty.csv')
+    df = read_transactions(csv_file_path)
+
+    df = categorize_descriptions(df)
+
+    # Save the modified DataFrame back to a new CSV file
+    new_csv_file_path = os.path.join(current_dir, 'Data', 'clean.csv')
+    write_transactions(df, new_csv_file_path)
+
+    # Remove the original file after saving the new one
+    os.remove(csv_file_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Author: Adrien Protzel
+
+This module loads Configs/config.json once, validates it and compiles it into a registry with
+the lookups the stages need, so no stage parses the file again or loops over every entry to find
+an account. The compiled registry is cached by the modification time of the file, so it is only
+rebuilt when the file changes.
+
+Modules used:
+- json: For reading configuration files.
+- os: For reading the modification time of the configuration file.
+
+Functions:
+- folder_name(entry): Returns the Data folder name of an account.
+- validate_entries(entries): Checks that every configuration entry is complete and unique.
+- get_registry(config_path): Returns the compiled registry of a configuration file, rebuilding it when the file changes.
+- as_registry(configs): Returns a registry for a registry or a list of configuration entries.
+
+Classes:
+- ConfigRegistry: The configuration entries with lookups by folder, type and bank.
+"""
+
+import json
+import os
+
+# Default configuration file
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Configs', 'config.json')
+
+def folder_name(entry):
+    """Return the Data folder name of an account, e.g. Credit_Chase_Prime."""
+    return f"{entry['type']}_{entry['bank']}_{entry['card']}"
+
+def validate_entries(entries):
+    """
+    Check that every configuration entry is complete and that no account is configured twice.
+
+    Args:
+        entries (list): Configuration entries from config.json.
+
+    Raises:
+        ValueError: If an entry is missing a field, has a field of the wrong type, or repeats an account.
+    """
+    if not isinstance(entries, list):
+        raise ValueError("config.json must contain a list of accounts")
+
+    seen = set()
+    for index, entry in enumerate(entries):
+        for key in ('type', 'bank', 'card'):
+            if not isinstance(entry.get(key), str) or not entry[key]:
+                raise ValueError(f"config.json entry {index} needs a '{key}' name")
+        if not isinstance(entry.get('remove_rows'), int) or entry['remove_rows'] < 0:
+            raise ValueError(f"config.json entry {index} ({folder_name(entry)}) needs a 'remove_rows' count")
+        if 'add_header' in entry and not all(isinstance(column, str) for column in entry['add_header']):
+            raise ValueError(f"config.json entry {index} ({folder_name(entry)}) has a non-text column in 'add_header'")
+        if folder_name(entry) in seen:
+            raise ValueError(f"config.json entry {index} repeats the account {folder_name(entry)}")
+        seen.add(folder_name(entry))
+
+class ConfigRegistry:
+    """
+    The configuration entries in file order, with lookups by folder name, type and bank.
+
+    Iterating over the registry gives the entries, so it can be used wherever the list from
+    config.json was used before.
+    """
+
+    def __init__(self, entries):
+        """
+        Validate the entries and build the lookups.
+
+        Args:
+            entries (list): Configuration entries from config.json.
+        """
+        validate_entries(entries)
+        self.entries = entries
+
+        # folder name -> entry, type -> banks and (type, bank) -> cards, all sorted for the menus
+        self.by_folder = {folder_name(entry): entry for entry in entries}
+        banks = {}
+        cards = {}
+        for entry in entries:
+            banks.setdefault(entry['type'], set()).add(entry['bank'])
+            cards.setdefault((entry['type'], entry['bank']), set()).add(entry['card'])
+        self.types = sorted(banks)
+        self.banks = {type_: sorted(names) for type_, names in banks.items()}
+        self.cards = {key: sorted(names) for key, names in cards.items()}
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def folder(self, name):
+        """Return the entry of a Data folder name, or None if the folder is not configured."""
+        return self.by_folder.get(name)
+
+    def account(self, type_, bank, card):
+        """Return the entry of an account, or None if it is not configured."""
+        return self.by_folder.get(f"{type_}_{bank}_{card}")
+
+# Compiled registries by file path, with the file state they were built from
+_compiled_registries = {}
+
+def get_registry(config_path=CONFIG_PATH):
+    """Return the compiled registry of a configuration file, rebuilding it only when the file has changed."""
+    config_path = os.fspath(config_path)
+    stat = os.stat(config_path)
+    file_state = (stat.st_mtime_ns, stat.st_size)
+    cached = _compiled_registries.get(config_path)
+    if cached is None or cached[0] != file_state:
+        with open(config_path, 'r') as f:
+            cached = (file_state, ConfigRegistry(json.load(f)))
+        _compiled_registries[config_path] = cached
+    return cached[1]
+
+def as_registry(configs):
+    """Return the registry itself, or a registry built from a list of configuration entries."""
+    if isinstance(configs, ConfigRegistry):
+        return configs
+    return ConfigRegistry(list(configs))
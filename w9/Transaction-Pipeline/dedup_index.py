@@ -0,0 +1,138 @@
+"""
+Author: Adrien Protzel
+
+This module removes the transactions that were already imported from another statement, e.g. when
+a monthly statement and a year-to-date export of the same card overlap.
+
+Every transaction gets a key from its account, date, amount in cents and raw description (lowercase,
+with repeated spaces collapsed), followed by its occurrence number among the rows of its statement
+with the same values. The occurrence number keeps real repeats, like two identical coffees on the
+same day: the second one is only dropped if the other statement also has a second one.
+
+The keys of every row appended to clean.csv are stored in an embedded SQLite database in the Data
+folder, so a run checks each new row with an indexed lookup instead of reading clean.csv again.
+The keys are only stored once the rows are in clean.csv, so a run that fails in between does not
+drop its rows the next time. Rows imported before the index existed are not in it.
+
+Modules used:
+- hashlib: For hashing the transaction keys.
+- os: For interacting with the operating system.
+- sqlite3: For storing the keys.
+- pandas: For data manipulation and analysis.
+
+Functions:
+- transaction_keys(df): Returns the key of every transaction.
+- connect(index_path): Opens the index, creating it the first time.
+- contains(index_path, keys): Returns which keys are already in the index.
+- add_keys(index_path, keys): Adds the keys of the rows appended to clean.csv to the index.
+- remove_duplicates(df, directory): Removes the transactions already imported, from an earlier run or another statement of this run.
+"""
+
+import hashlib
+import os
+import sqlite3
+import pandas as pd
+from instrumentation import stage, count
+from import_manifest import SOURCE_COLUMN
+
+# Name of the index database in the Data folder
+INDEX_FILE = 'dedup.sqlite3'
+
+# Name of the column that carries the key of each row until clean.csv is written
+KEY_COLUMN = 'Key'
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS transactions (key BLOB PRIMARY KEY) WITHOUT ROWID"
+
+# Number of keys looked up per query, below the SQLite limit of query parameters
+LOOKUP_BATCH = 500
+
+def transaction_keys(df):
+    """
+    Return the key of every transaction, a hash of its account, date, amount, raw description and occurrence number.
+
+    Args:
+        df (DataFrame): Transactions with their raw descriptions and the Source column.
+
+    Returns:
+        Series: The hexadecimal key of every row.
+    """
+    values = (df['Type'].astype(str) + '_' + df['Bank'].astype(str) + '_' + df['Card'].astype(str)
+              + '|' + df['Date'].dt.strftime('%Y-%m-%d').fillna('')
+              + '|' + df['Amount'].astype('string').fillna('')
+              # Collapsed with a regex, since split and join give an object column on an empty batch
+              + '|' + df['Description'].astype(str).str.lower().str.replace(r'\s+', ' ', regex=True).str.strip())
+
+    # Occurrence number of each value within its statement, so repeats of the same day are kept
+    statements = df[SOURCE_COLUMN] if SOURCE_COLUMN in df.columns else pd.Series('', index=df.index)
+    occurrences = values.groupby([statements.fillna('').to_numpy(), values.to_numpy()]).cumcount()
+
+    keys = values + '|' + occurrences.astype(str)
+    return keys.map(lambda key: hashlib.blake2b(key.encode(), digest_size=16).hexdigest())
+
+def connect(index_path):
+    """Open the index, creating it the first time."""
+    connection = sqlite3.connect(index_path, timeout=30)
+    connection.execute(SCHEMA)
+    return connection
+
+def contains(index_path, keys):
+    """
+    Return which keys are already in the index.
+
+    Args:
+        index_path (str): Path to the index database.
+        keys (list): Hexadecimal keys.
+
+    Returns:
+        set: The keys found in the index.
+    """
+    if not os.path.exists(index_path):
+        return set()
+
+    found = set()
+    connection = connect(index_path)
+    try:
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = [bytes.fromhex(key) for key in keys[start:start + LOOKUP_BATCH]]
+            placeholders = ','.join('?' * len(batch))
+            rows = connection.execute(f"SELECT key FROM transactions WHERE key IN ({placeholders})", batch)
+            found.update(row[0].hex() for row in rows)
+    finally:
+        connection.close()
+    return found
+
+def add_keys(index_path, keys):
+    """
+    Add the keys of the rows appended to clean.csv to the index, in one transaction.
+
+    Args:
+        index_path (str): Path to the index database.
+        keys (list): Hexadecimal keys.
+    """
+    connection = connect(index_path)
+    try:
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO transactions (key) VALUES (?)",
+                                   ((bytes.fromhex(key),) for key in keys))
+    finally:
+        connection.close()
+
+@stage("dedup_index")
+def remove_duplicates(df, directory):
+    """
+    Remove the transactions that were already imported, in an earlier run or from another statement of this run.
+
+    Runs before the descriptions are cleaned, since the keys use the raw descriptions.
+
+    Args:
+        df (DataFrame): The dirty transactions of this run, with the Source column.
+        directory (str): Path to the Data directory.
+
+    Returns:
+        DataFrame: The new transactions, with the Key column for write_clean_file.
+    """
+    df[KEY_COLUMN] = transaction_keys(df)
+    imported = contains(os.path.join(directory, INDEX_FILE), df[KEY_COLUMN].unique().tolist())
+    duplicates = df[KEY_COLUMN].isin(imported) | df[KEY_COLUMN].duplicated()
+    count("duplicate_rows", duplicates.sum())
+    return df[~duplicates].reset_index(drop=True)
@@ -2,122 +2,108 @@
 Author: Adrien Protzel
 
 This script processes a CSV file to replace transaction descriptions based on a predefined mapping.
-If a description does not match any keyphrase, a manual input window is displayed to allow the user
-to enter the correct description.
+Descriptions that do not match any keyphrase are looked up in the similarity index: near duplicates
+of a known description are replaced automatically, and the rest are added to the review queue with
+their closest known descriptions as suggestions, where the user can enter the correct description
+for all of them in a single review window.
 
 Modules used:
+- numpy: For picking the unmatched descriptions.
 - pandas: For data manipulation and analysis.
-- tkinter: For creating the GUI.
+- os: For interacting with the operating system.
 
 Functions:
-- load_description_map(): Loads the description map from a file.
-- replace_description(row): Replaces descriptions based on the mapping and displays a manual input window if no match is found.
+- load_description_map(): Loads the description map from the map store.
+- map_description(description): Looks up a description in the compiled description map.
+- clean_descriptions(df, queue): Lowercases and replaces every description in a dataframe and queues the unmatched ones for review.
 """
 
+import numpy as np
 import pandas as pd
-import tkinter as tk
 import os
+from map_store import DESCRIPTION_MAP, load_rules, get_keyword_map
+from instrumentation import stage, count
+from transaction_schema import read_transactions, write_transactions
+from review_queue import ReviewQueue
+from similarity_index import AUTO_ACCEPT_THRESHOLD, get_similarity_index
 
-# Load the CSV file
 current_dir = os.path.dirname(os.path.abspath(__file__))
-csv_file_path = os.path.join(current_dir, 'Data', 'dirty.csv')
-df = pd.read_csv(csv_file_path)
-
-# Ensure the 'Description' column is of type string and convert to lowercase
-df['Description'] = df['Description'].astype(str).str.lower()
 
 def load_description_map():
-    """Load the description map file."""
-    description_map_file_path = os.path.join(current_dir, 'Configs', 'Maps', 'description_map.txt')
-    description_map = {}
-    with open(description_map_file_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split(',')
-            if len(parts) == 2:
-                description_map[parts[0]] = parts[1]
-    return description_map
-
-def replace_description(row):
-    """Replace descriptions based on the mapping."""
-    description_map = load_description_map()
-    description = row['Description']
-    for keyphrase, mapped_description in description_map.items():
-        if description == mapped_description:
-            return description  # Skip if it matches the true description exactly
-        if keyphrase in description:
-            return mapped_description
-    
-    # If no mapping is found, show a popup window with the current description
-    def cancel():
-        root.destroy()
-        raise SystemExit
-
-    def skip():
-        root.destroy()
-
-    def enter(event=None):
-        keyword = keyword_entry.get().lower()
-        true_description = true_description_entry.get().lower()
-        
-        # Append the new mapping to the description_map.txt file
-        with open(os.path.join(current_dir, 'Configs', 'Maps', 'description_map.txt'), 'a') as f:
-            f.write(f"{keyword},{true_description}\n")
-        
-        root.destroy()
-
-    root = tk.Tk()
-    root.title("Manual Description Mapping")
-
-    def center_window(window, width, height):
-        """Center the window on the screen."""
-        window.update_idletasks()
-        x = (window.winfo_screenwidth() // 2) - (width // 2)
-        y = (window.winfo_screenheight() // 2) - (height // 2)
-        window.geometry(f'{width}x{height}+{x}+{y}')
-
-    # Make the window wider to show the whole description
-    center_window(root, width=500, height=250)
-
-    info_label = tk.Label(root, text=f"{row['Date']}: {row['Card']}: {row['Amount']}")
-    info_label.pack(pady=5)
-
-    description_label = tk.Label(root, text=description, wraplength=480)
-    description_label.pack(pady=10)
-
-    frame = tk.Frame(root)
-    frame.pack(pady=10)
-
-    instruction_label1 = tk.Label(frame, text="Enter Description Keyword:", anchor='e', justify='right')
-    instruction_label1.grid(row=0, column=0, sticky='e')
-    keyword_entry = tk.Entry(frame)
-    keyword_entry.grid(row=0, column=1)
-    keyword_entry.insert(0, description)  # Prefill with the current description
-
-    instruction_label2 = tk.Label(frame, text="Enter True Description:", anchor='e', justify='right')
-    instruction_label2.grid(row=1, column=0, sticky='e')
-    true_description_entry = tk.Entry(frame)
-    true_description_entry.grid(row=1, column=1)
-    true_description_entry.insert(0, description)  # Prefill with the current description
-
-    button_frame = tk.Frame(root)
-    button_frame.pack(pady=10)
-
-    cancel_button = tk.Button(button_frame, text="Cancel", command=cancel)
-    cancel_button.grid(row=0, column=0, padx=(0, 20))  # Add space between Cancel and Skip button
-
-    skip_button = tk.Button(button_frame, text="Skip", command=skip)
-    skip_button.grid(row=0, column=1, padx=(0, 20))  # Add space between Skip and Enter button
-
-    enter_button = tk.Button(button_frame, text="Enter", command=enter)
-    enter_button.grid(row=0, column=2)
-
-    root.bind('<Return>', enter)  # Bind the Enter key to the enter function
-
-    root.mainloop()
-
-    return description
-
-df['Description'] = df.apply(replace_description, axis=1)
-
-# Save the modified DataFrame back to the CSV file
-df.to_csv(csv_file_path, index=False)
\ No newline at end of file
+    """Load the description map from the map store."""
+    return load_rules(DESCRIPTION_MAP)
+
+def map_description(description):
+    """
+    Look up a description in the compiled description map.
+
+    The first keyphrase in file order that occurs in the description wins, and a description
+    that already matches a true description exactly is kept as it is.
+
+    Returns:
+        str: The mapped description, or None if no keyphrase matches.
+    """
+    return get_keyword_map(DESCRIPTION_MAP).lookup(description, match_values=True)
+
+@stage("desc_cleaner")
+def clean_descriptions(df, queue=None):
+    """
+    Replace every description in the dataframe based on the mapping, resolving each unique description once.
+
+    Descriptions without a match are looked up in the similarity index. A description whose best
+    suggestion scores at least AUTO_ACCEPT_THRESHOLD takes its true description, the others keep
+    their text and are added to the review queue with their suggestions. Without a queue, they are
+    reviewed right away in a single review window.
+
+    Args:
+        df (DataFrame): The transactions.
+        queue (ReviewQueue): The review queue of the run, or None to review the unmatched descriptions here.
+
+    Returns:
+        DataFrame: The transactions with the mapped descriptions.
+    """
+    # Ensure the 'Description' column is of type string and convert to lowercase
+    df['Description'] = df['Description'].astype(str).str.lower()
+
+    # Match every unique description against the compiled map once
+    codes, descriptions = pd.factorize(df['Description'])
+    mapped = pd.Series([map_description(description) for description in descriptions], dtype=object)
+
+    count("unmatched_descriptions", mapped.isna().to_numpy()[codes].sum())
+
+    # Accept the near duplicates of known descriptions, e.g. with another store number
+    suggestions = {}
+    unmatched_codes = np.flatnonzero(mapped.isna())
+    if len(unmatched_codes):
+        candidates = get_similarity_index().suggest(list(descriptions[unmatched_codes]))
+        for code, description_candidates in zip(unmatched_codes, candidates):
+            if (AUTO_ACCEPT_THRESHOLD is not None and description_candidates
+                    and description_candidates[0][2] >= AUTO_ACCEPT_THRESHOLD):
+                mapped[code] = description_candidates[0][0]
+                count("auto_accepted_descriptions")
+            else:
+                suggestions[descriptions[code]] = description_candidates
+
+    # Descriptions without a match keep their text until they are reviewed
+    unmatched = mapped.isna().to_numpy()[codes]
+    df['Description'] = mapped.fillna(pd.Series(descriptions)).to_numpy()[codes]
+
+    review = queue is None
+    if review:
+        queue = ReviewQueue()
+    queue.add_descriptions(df[unmatched], suggestions)
+    return queue.review(df) if review else df
+
+def main():
+    """Replace the descriptions in dirty.csv."""
+    # Load the CSV file
+    csv_file_path = os.path.join(current_dir, 'Data', 'dirty.csv')
+    df = read_transactions(csv_file_path)
+
+    df = clean_descriptions(df)
+
+    # Save the modified DataFrame back to the CSV file
+    write_transactions(df, csv_file_path)
+
+if __name__ == "__main__":
+    main()
@@ -2,32 +2,63 @@
 Author: Adrien Protzel
 
 This script processes CSV files in a directory by performing various cleaning and transformation tasks.
-It merges the cleaned data into a single CSV file and then runs additional cleaning scripts.
+It merges the cleaned data into a single dataframe and then runs the additional cleaning stages.
+
+The statement files are cleaned in a process pool sized to the machine. Each worker sends its
+statement back as an Arrow IPC buffer instead of a pickled dataframe, and the statements are merged
+in file order so the result is the same as cleaning them one after another.
 
 Modules used:
+- csv: For counting the rows of clean.csv.
 - os: For interacting with the operating system.
 - pandas: For data manipulation and analysis.
-- json: For reading configuration files.
 - shutil: For file operations.
-- subprocess: For running external scripts.
-- datetime: For date and time operations.
+- concurrent.futures: For cleaning the statement files in parallel.
+- pyarrow: For sending the cleaned statements back from the workers (optional, they are pickled without it).
 
 Functions:
 - list_files_in_directory(directory): Lists all files in a directory and its subdirectories.
-- remove_star_columns_from_csv(file_path): Removes columns labeled "*" from a CSV file.
-- update_csv_header(file_path, new_header): Updates the header of a CSV file and adds empty fields for new columns if necessary.
-- fill_in_type_bank_card(file_path, config): Fills in Type, Bank, and Card columns based on a configuration.
-- clean_amount_column(file_path): Cleans the Amount column by converting it to a float with two decimal places.
-- fill_year_month_columns(file_path): Extracts Year and Month from the Date column.
-- remove_empty_amount_rows(file_path): Removes rows where the Amount column is empty or NaN.
+- remove_star_columns(df): Removes columns labeled "*" from a dataframe.
+- update_header(df, new_header): Reorders the columns to the new header and adds empty fields for new columns if necessary.
+- fill_in_type_bank_card(df, config): Fills in Type, Bank, and Card columns based on a configuration.
+- clean_amount_column(df): Cleans the Amount column by converting it to integer cents.
+- clean_statement(file_path, config): Reads a statement CSV file once and applies all of the above to it.
+- clean_statement_worker(file_path, config): Cleans a statement in a worker process and returns it as an Arrow buffer with its measurements.
+- read_statement_buffer(result): Reads a cleaned statement sent back by a worker and adds its measurements to the run report.
+- fill_year_month_columns(df): Extracts Year and Month from the Date column, parsing each distinct date once.
+- remove_empty_amount_rows(df): Removes rows where the Amount column is empty or NaN.
+- merge_account_files(directory, configs, workers, skip_files): Cleans every account CSV file in parallel and merges them into a single dataframe.
+- remove_account_files(directory): Removes the account CSV files and their folders.
+- append_bad_lines(df, rows): Appends manually corrected bad lines to the dataframe.
+- clean_files(directory, configs, remove_files, interactive, skip_files): Runs the whole file cleaning stage and returns the dirty dataframe.
+- count_rows(file_path): Counts the data rows of a CSV file.
+- write_clean_file(df, directory, run_id): Appends the new clean rows to clean.csv and the Parquet dataset, and records them in the import manifest and the duplicate index.
 """
 
+import csv
 import os
 import pandas as pd
-import json
 import shutil
-import subprocess
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from bad_lines_cleaner import clean_bad_lines
+from config_registry import get_registry, as_registry
+from parquet_writer import PARQUET_DIR, write_parquet_dataset
+import instrumentation
+from instrumentation import stage, count
+from transaction_schema import (CLEAN_HEADER, DTYPES, apply_schema, derive_date_columns, parse_amounts,
+                                write_transactions)
+from import_manifest import MANIFEST_FILE, SOURCE_COLUMN, load_manifest, save_manifest, record_clean_rows
+from desc_cleaner import clean_descriptions
+from cat_cleaner import categorize_descriptions
+from review_queue import ReviewQueue
+from dedup_index import INDEX_FILE, KEY_COLUMN, add_keys, remove_duplicates
+from stage_journal import CHECKPOINT_DIR
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 
 def list_files_in_directory(directory):
     """List all files in a directory and its subdirectories."""
@@ -37,112 +68,246 @@ def list_files_in_directory(directory):
             file_paths.append(os.path.join(root, file))
     return file_paths
 
-def remove_star_columns_from_csv(file_path):
-    """Remove columns labeled "*" from a CSV file."""
-    df = pd.read_csv(file_path)
-    df = df.loc[:, ~df.columns.str.contains('\\*')]
-    df.to_csv(file_path, index=False)
+def remove_star_columns(df):
+    """Remove columns labeled "*" from a dataframe."""
+    return df.loc[:, ~df.columns.str.contains('\\*')]
 
-def update_csv_header(file_path, new_header):
-    """Update the header of a CSV file and add empty fields for new columns if necessary."""
-    df = pd.read_csv(file_path)
+def update_header(df, new_header):
+    """Reorder the columns to the new header and add empty fields for new columns if necessary."""
     for column in new_header:
         if column not in df.columns:
-            df[column] = ""
-    df = df[new_header]
-    df.to_csv(file_path, index=False)
+            df[column] = float('nan')
+    return df[new_header]
 
-def fill_in_type_bank_card(file_path, config):
+def fill_in_type_bank_card(df, config):
     """Fill in Type, Bank, and Card columns based on a configuration."""
-    df = pd.read_csv(file_path)
     df['Type'] = config['type']
     df['Bank'] = config['bank']
     df['Card'] = config['card']
-    df.to_csv(file_path, index=False)
-
-def clean_amount_column(file_path):
-    """Clean the Amount column by converting it to a float with two decimal places."""
-    df = pd.read_csv(file_path)
-    df['Amount'] = df['Amount'].replace(r'[\$,]', '', regex=True).astype(float)
-    df['Amount'] = df['Amount'].map('{:.2f}'.format)
-    df.to_csv(file_path, index=False)
-
-def fill_year_month_columns(file_path):
-    """Extract Year and Month from the Date column."""
-    df = pd.read_csv(file_path)
-    df['Year'] = pd.to_datetime(df['Date'], format='%m/%d/%Y').dt.year
-    df['Month'] = pd.to_datetime(df['Date'], format='%m/%d/%Y').dt.strftime('%B')
-    df.to_csv(file_path, index=False)
-
-def remove_empty_amount_rows(file_path):
+    return df
+
+def clean_amount_column(df):
+    """Clean the Amount column by converting it to integer cents, <NA> where it is empty."""
+    df['Amount'] = parse_amounts(df['Amount'])
+    return df
+
+@stage("clean_statement")
+def clean_statement(file_path, config):
+    """
+    Read a statement CSV file once and apply every column transform to it in memory.
+
+    Args:
+        file_path (str): Path to the statement CSV file.
+        config (dict): Configuration entry of the account, or None if the folder has none.
+
+    Returns:
+        DataFrame: The statement with the new header and Source, Type, Bank, Card, and Amount in cents.
+    """
+    # Every column is read as text, Amount is converted by clean_amount_column and the rest by the schema
+    df = pd.read_csv(file_path, dtype=str)
+    df = remove_star_columns(df)
+    df = update_header(df, new_header + [SOURCE_COLUMN])
+    if config is not None:
+        df = fill_in_type_bank_card(df, config)
+    return clean_amount_column(df)
+
+def clean_statement_worker(file_path, config):
+    """
+    Clean a statement in a worker process.
+
+    Returns:
+        tuple: The cleaned statement as an Arrow IPC stream, or the dataframe itself without pyarrow,
+        and the measurements of the task for the run report.
+    """
+    # Drop the measurements the worker inherited from the parent, only this task is sent back
+    instrumentation.collect()
+    df = clean_statement(file_path, config)
+    if pa is None:
+        return df, instrumentation.collect()
+
+    # One contiguous buffer is sent back to the parent instead of pickling every column
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue(), instrumentation.collect()
+
+def read_statement_buffer(result):
+    """Read a cleaned statement sent back by clean_statement_worker, adding its measurements to the run report."""
+    buffer, measurements = result
+    instrumentation.merge(measurements)
+    if pa is None:
+        return buffer
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+@stage("fill_year_month_columns")
+def fill_year_month_columns(df):
+    """Extract Year and Month from the Date column, parsing each distinct date once."""
+    return derive_date_columns(df)
+
+@stage("remove_empty_amount_rows")
+def remove_empty_amount_rows(df):
     """Remove rows where the Amount column is empty or NaN."""
-    df = pd.read_csv(file_path)
-    df = df[df['Amount'].notna() & (df['Amount'] != '')]
-    df.to_csv(file_path, index=False)
+    count("empty_amount_rows", df['Amount'].isna().sum())
+    return df[df['Amount'].notna()]
+
+@stage("merge_account_files")
+def merge_account_files(directory, configs, workers=None, skip_files=()):
+    """
+    Clean every account CSV file in the directory and merge them into a single dataframe.
+
+    Args:
+        directory (str): Path to the Data directory.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        workers (int): Number of worker processes, the number of CPUs by default. 1 cleans the files in this process.
+        skip_files (iterable): Names of other output files in the Data directory, e.g. the checkpoints of main.py.
+
+    Returns:
+        DataFrame: The cleaned statements in file order.
+    """
+    configs = as_registry(configs)
+
+    # Get list of all files in the directory and its subdirectories
+    all_files = list_files_in_directory(directory)
+
+    # Match each CSV file with the config of its folder
+    # Outputs left in the Data directory by an earlier run are not statements
+    outputs = {os.path.join(directory, file_name) for file_name in ('clean.csv', *skip_files)}
+    files = []
+    file_configs = []
+    for file in all_files:
+        if file.endswith('.csv') and file not in outputs:
+            # Determine the folder name and match it with config
+            files.append(file)
+            file_configs.append(configs.folder(os.path.basename(os.path.dirname(file))))
+
+    # Nothing new to clean
+    if not files:
+        return pd.DataFrame(columns=new_header + [SOURCE_COLUMN])
+
+    # Remove columns labeled "*", update the header, fill in Type, Bank, Card, and clean Amount column of every file
+    workers = min(len(files), workers or os.cpu_count() or 1)
+    if workers == 1:
+        dataframes = [clean_statement(file, file_config) for file, file_config in zip(files, file_configs)]
+    else:
+        # map returns the results in file order, whichever worker finishes first
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            dataframes = [read_statement_buffer(result) for result in executor.map(clean_statement_worker, files, file_configs)]
+
+    # Merge all dataframes into a single dataframe
+    return pd.concat(dataframes, ignore_index=True)
+
+@stage("remove_account_files")
+def remove_account_files(directory):
+    """Remove old CSV files and their respective folders."""
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.csv') and file not in ('dirty.csv', 'clean.csv'):
+                os.remove(os.path.join(root, file))
+
+    # Keep the Parquet dataset and the run checkpoints, only the account folders are removed
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.name not in (PARQUET_DIR, CHECKPOINT_DIR):
+            shutil.rmtree(entry.path)
+
+def append_bad_lines(df, rows):
+    """Append manually corrected bad lines to the dataframe."""
+    if not rows:
+        return df
+    # The corrected rows already carry their Amount in cents
+    bad_lines = pd.DataFrame(rows, columns=new_header).astype({'Amount': DTYPES['Amount']})
+    return pd.concat([df, bad_lines], ignore_index=True)
+
+@stage("file_cleaner")
+def clean_files(directory, configs, remove_files=True, interactive=True, skip_files=()):
+    """
+    Run the file cleaning stage on the Data directory.
+
+    Args:
+        directory (str): Path to the Data directory.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        remove_files (bool): Remove the account files and the bad lines that were read once they are
+            cleaned. main.py removes them itself once the result of the stage is saved in the stage journal.
+        interactive (bool): Show the bad lines windows, see clean_bad_lines.
+        skip_files (iterable): Names of other output files in the Data directory, see merge_account_files.
+
+    Returns:
+        DataFrame: The merged dirty transactions with the schema types, ready for the description cleaner.
+    """
+    df = merge_account_files(directory, configs, skip_files=skip_files)
+
+    # Add the bad lines corrected in bad_lines_cleaner.py
+    df = append_bad_lines(df, clean_bad_lines(Path(directory) / 'bad_lines.txt', configs, interactive, remove_files))
+
+    # Fill in Year and Month columns after the bad lines have been added
+    df = fill_year_month_columns(df)
+
+    # Remove rows with empty 'Amount' column in the merged dataframe
+    df = remove_empty_amount_rows(df)
+    df = apply_schema(df)
+
+    # The account files are only removed once nothing can stop the stage anymore
+    if remove_files:
+        remove_account_files(directory)
+    return df
+
+def count_rows(file_path):
+    """Count the data rows of a CSV file, 0 if it does not exist."""
+    if not os.path.exists(file_path):
+        return 0
+    # Read as CSV records, since a quoted description can hold line breaks
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        records = sum(1 for _ in csv.reader(f))
+    return max(records - 1, 0)
+
+@stage("write_clean_file")
+def write_clean_file(df, directory, run_id=None):
+    """
+    Append the new clean rows to clean.csv and the Parquet dataset, and record them in the import manifest
+    and the duplicate index.
+
+    Args:
+        df (DataFrame): The clean transactions of this run, with the Source column and the Key column of remove_duplicates.
+        directory (str): Path to the Data directory.
+        run_id (int): ID of the run in the stage journal, so writing the Parquet files again overwrites them.
+    """
+    clean_file_path = os.path.join(directory, 'clean.csv')
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+    # Only the new rows are written, clean.csv is created with a header the first time
+    first_row = count_rows(clean_file_path)
+    header = not os.path.exists(clean_file_path)
+    write_transactions(df.drop(columns=[SOURCE_COLUMN, KEY_COLUMN], errors='ignore'), clean_file_path, mode='a', header=header)
+    write_parquet_dataset(df, os.path.join(directory, PARQUET_DIR), run_id)
+
+    # Add the rows to the duplicate index only now that they are in clean.csv
+    if KEY_COLUMN in df.columns:
+        add_keys(os.path.join(directory, INDEX_FILE), df[KEY_COLUMN].tolist())
+
+    # Mark the files of this run as imported
+    manifest = load_manifest(manifest_path)
+    record_clean_rows(manifest, df[SOURCE_COLUMN].reset_index(drop=True), first_row)
+    save_manifest(manifest_path, manifest)
 
 # Directory to search
 current_dir = os.path.dirname(os.path.abspath(__file__))
 directory = os.path.join(current_dir, 'Data')
 
-# Load config.json from Configs folder
-config_path = os.path.join(current_dir, 'Configs', 'config.json')
-with open(config_path, 'r') as f:
-    configs = json.load(f)
-
 # New header to be applied to all CSV files
-new_header = ["Year", "Month", "Date", "Description", "Category", "Amount", "Type", "Bank", "Card"]
-
-# Get list of all files in the directory and its subdirectories
-all_files = list_files_in_directory(directory)
-
-# List to store all dataframes for merging later
-dataframes = []
-
-# Process each CSV file to remove columns labeled "*", update the header, fill in Type, Bank, Card, and clean Amount column
-for file in all_files:
-    if file.endswith('.csv'):
-        remove_star_columns_from_csv(file)
-        update_csv_header(file, new_header)
-        
-        # Determine the folder name and match it with config
-        folder_name = os.path.basename(os.path.dirname(file))
-        for config in configs:
-            if folder_name == f"{config['type']}_{config['bank']}_{config['card']}":
-                fill_in_type_bank_card(file, config)
-                break
-        
-        clean_amount_column(file)
-        
-        # Read the cleaned CSV into a dataframe and add it to the list of dataframes
-        dataframes.append(pd.read_csv(file))
-
-# Merge all dataframes into a single dataframe
-merged_df = pd.concat(dataframes)
-
-# Save the merged dataframe to dirty.csv in the Data folder
-merged_df.to_csv(os.path.join(directory, 'dirty.csv'), index=False)
-
-# Remove old CSV files and their respective folders
-for root, dirs, files in os.walk(directory):
-    for file in files:
-        if file.endswith('.csv') and file != 'dirty.csv':
-            os.remove(os.path.join(root, file))
-            
-for root, dirs, files in os.walk(directory):
-    for dir in dirs:
-        shutil.rmtree(os.path.join(root, dir))
-
-# Call bad_lines_cleaner.py as a subprocess
-subprocess.run(['python', os.path.join(current_dir, 'bad_lines_cleaner.py')])
-
-# Fill in Year and Month columns after bad_lines_cleaner.py has run
-fill_year_month_columns(os.path.join(directory, 'dirty.csv'))
-
-# Remove rows with empty 'Amount' column in the merged dataframe
-remove_empty_amount_rows(os.path.join(directory, 'dirty.csv'))
-
-# Call desc_cleaner.py as a subprocess
-subprocess.run(['python', os.path.join(current_dir, 'desc_cleaner.py')])
-
-# Call cat_cleaner.py as a subprocess
-subprocess.run(['python', os.path.join(current_dir, 'cat_cleaner.py')])
\ No newline at end of file
+new_header = CLEAN_HEADER
+
+def main():
+    """Clean the files in Data and run the description and category cleaners on the result."""
+    # Load config.json from Configs folder
+    configs = get_registry(os.path.join(current_dir, 'Configs', 'config.json'))
+
+    df = clean_files(directory, configs)
+    df = remove_duplicates(df, directory)
+    queue = ReviewQueue()
+    df = clean_descriptions(df, queue)
+    df = categorize_descriptions(df, queue)
+    df = queue.review(df)
+    write_clean_file(df, directory)
+
+if __name__ == "__main__":
+    main()
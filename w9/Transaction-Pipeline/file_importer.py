@@ -3,23 +3,25 @@ Author: Adrien Protzel
 
 This script creates a GUI application using Tkinter to organize files based on user selections.
 Users can drag and drop files into the application, which then copies the files to appropriate folders
-based on the selected type, bank, and card.
+based on the selected type, bank, and card. Files dropped without a selection are copied to the
+account their format matches (see format_detector.py), and a selection that does not fit the format
+of a file has to be confirmed.
 
 Modules used:
 - tkinter: For creating the GUI.
 - tkinterdnd2: For drag-and-drop functionality in Tkinter.
 - os: For interacting with the operating system.
 - shutil: For file operations.
-- json: For reading configuration files.
 
 Functions:
 - drop(event): Handles file drop events and copies files to appropriate folders.
-- copy_file(file): Copies a file to the appropriate folder based on user selections.
+- copy_file(file): Copies a file to the appropriate folder based on user selections or its detected format.
 - update_bank_options(*args): Updates bank options based on the selected type.
 - update_card_options(*args): Updates card options based on the selected type and bank.
 - cancel(): Closes the application.
 - create_dropdown(label_text, variable, options, parent, default_value): Creates a dropdown menu with a label.
 - center_window(window, width, height): Centers the window on the screen with specified width and height.
+- main(): Opens the file organizer window.
 """
 
 import tkinter as tk
@@ -27,27 +29,16 @@ from tkinter import messagebox
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import os
 import shutil
-import json
+from config_registry import get_registry, folder_name
+from format_detector import detect_format
 
 # Load configuration from Configs/config.json
-config_path = os.path.join(os.path.dirname(__file__), 'Configs', 'config.json')
-with open(config_path, 'r') as f:
-    config = json.load(f)
-
-# Extract unique options for type, bank, and card
-types = sorted(set(item['type'] for item in config))
-banks = {}
-cards = {}
-
-# Populate banks and cards dictionaries based on the config data
-for item in config:
-    if item['type'] not in banks:
-        banks[item['type']] = set()
-    banks[item['type']].add(item['bank'])
-    
-    if (item['type'], item['bank']) not in cards:
-        cards[(item['type'], item['bank'])] = set()
-    cards[(item['type'], item['bank'])].add(item['card'])
+config = get_registry()
+
+# Options for type, bank, and card, precomputed by the registry
+types = config.types
+banks = config.banks
+cards = config.cards
 
 def drop(event):
     """
@@ -71,7 +62,11 @@ def drop(event):
 
 def copy_file(file):
     """
-    Copy the file to the appropriate folder based on user selections.
+    Copy the file to the appropriate folder based on user selections, or on its detected format.
+
+    Without a selection the file is copied to the account its format matches. A file whose format
+    fits several accounts or none is not guessed: the user is asked to pick its account. A
+    selection that does not fit the detected format has to be confirmed.
     
     Args:
         file (str): The path of the file to be copied.
@@ -79,10 +74,23 @@ def copy_file(file):
     type_selection = type_var.get()
     bank_selection = bank_var.get()
     card_selection = card_var.get()
+    selection = f"{type_selection}_{bank_selection}_{card_selection}"
+    detected = [folder_name(entry) for entry in detect_format(file, config)]
+    name = os.path.basename(file)
+
+    if not (type_selection and bank_selection and card_selection):
+        if len(detected) != 1:
+            reason = f"matches the format of {', '.join(detected)}" if detected else "has an unknown format"
+            messagebox.showwarning("Pick Account", f"{name} {reason}. Pick its type, bank and card, then drop it again.")
+            return
+        selection = detected[0]
+    elif detected and selection not in detected:
+        if not messagebox.askyesno("Check Account", f"{name} looks like a {' or '.join(detected)} statement. Copy it to {selection} anyway?"):
+            return
     
     # Construct the folder path relative to the current program location
     base_path = os.path.join(os.path.dirname(__file__), "Data")
-    folder_path = os.path.join(base_path, f"{type_selection}_{bank_selection}_{card_selection}")
+    folder_path = os.path.join(base_path, selection)
     
     # Create the folder if it doesn't exist
     os.makedirs(folder_path, exist_ok=True)
@@ -162,38 +170,47 @@ def center_window(window, width, height):
     y = (window.winfo_screenheight() // 2) - (height // 2)
     window.geometry(f'{width}x{height}+{x}+{y}')
 
-# Initialize main window
-root = TkinterDnD.Tk()
-root.title("File Organizer")
+def main():
+    """
+    Open the file organizer window and wait until the user is done importing files.
+    """
+    global root, type_var, bank_var, card_var, bank_menu, card_menu
+
+    # Initialize main window
+    root = TkinterDnD.Tk()
+    root.title("File Organizer")
+
+    # Center the window with new dimensions
+    center_window(root, width=250, height=400)
 
-# Center the window with new dimensions
-center_window(root, width=250, height=400)
+    # Type dropdown
+    type_var = tk.StringVar()
+    type_menu = create_dropdown("Type:", type_var, types, root)
 
-# Type dropdown
-type_var = tk.StringVar()
-type_menu = create_dropdown("Type:", type_var, types, root)
+    # Bank dropdown
+    bank_var = tk.StringVar()
+    bank_menu = create_dropdown("Bank:", bank_var, [], root)
 
-# Bank dropdown
-bank_var = tk.StringVar()
-bank_menu = create_dropdown("Bank:", bank_var, [], root)
+    # Card dropdown
+    card_var = tk.StringVar()
+    card_menu = create_dropdown("Card:", card_var, [], root)
 
-# Card dropdown
-card_var = tk.StringVar()
-card_menu = create_dropdown("Card:", card_var, [], root)
+    # Bind update functions to type and bank dropdown changes
+    type_var.trace('w', update_bank_options)
+    bank_var.trace('w', update_card_options)
 
-# Bind update functions to type and bank dropdown changes
-type_var.trace('w', update_bank_options)
-bank_var.trace('w', update_card_options)
+    # Drag and drop area
+    drop_area = tk.Label(root, text="Drag and drop files here", width=60, height=15, bg="lightgray")
+    drop_area.pack(pady=20)
+    drop_area.drop_target_register(DND_FILES)
+    drop_area.dnd_bind('<<Drop>>', drop)
 
-# Drag and drop area
-drop_area = tk.Label(root, text="Drag and drop files here", width=60, height=15, bg="lightgray")
-drop_area.pack(pady=20)
-drop_area.drop_target_register(DND_FILES)
-drop_area.dnd_bind('<<Drop>>', drop)
+    # Cancel button
+    cancel_button = tk.Button(root, text="Cancel", command=cancel)
+    cancel_button.pack(pady=10)
 
-# Cancel button
-cancel_button = tk.Button(root, text="Cancel", command=cancel)
-cancel_button.pack(pady=10)
+    # Run the main loop
+    root.mainloop()
 
-# Run the main loop
-root.mainloop()
+if __name__ == "__main__":
+    main()
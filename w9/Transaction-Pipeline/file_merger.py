@@ -5,38 +5,48 @@ This program processes files in specified directories created by file_importer.p
 based on configurations provided in a config.json file. 
 
 It removes or adds headers as needed, records bad lines, and merges like files.
+Each account directory is merged in its own worker process. Files already listed in the import
+manifest are skipped, and every merged row is tagged with the manifest key of its file.
 """
 
-import json
 import csv
+import io
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from JSON_to_CSV import json_to_csv  # Correct import statement
-
+from JSON_to_CSV import ndjson_to_csv
+from config_registry import get_registry, as_registry
+from import_manifest import (MANIFEST_FILE, SOURCE_COLUMN, file_hash, manifest_key,
+                             load_manifest, save_manifest, imported_keys)
+from instrumentation import stage, count
+from statement_reader import open_statement
+from stage_journal import JOURNAL_FILE
+
+@stage("convert_json_files")
 def convert_json_files(folder_path):
     """
-    Convert all JSON files in the specified folder to CSV files.
+    Convert all JSON and NDJSON files in the specified folder to CSV files, streaming them in constant memory.
 
     Args:
         folder_path (Path): Path to the folder containing JSON files.
     """
     for file in folder_path.iterdir():
-        if file.suffix == '.json':
+        # The import manifest and the stage journal are kept in the Data folder, they are not statements
+        if file.suffix in ('.json', '.ndjson') and file.name not in (MANIFEST_FILE, JOURNAL_FILE):
             csv_file_path = file.with_suffix('.csv')
-            json_to_csv(file, csv_file_path)
+            ndjson_to_csv(file, csv_file_path)
 
 def load_config(config_path):
     """
-    Load the configuration file.
+    Load the configuration file through the config registry.
 
     Args:
         config_path (Path): Path to the configuration file.
 
     Returns:
-        dict: Configuration data.
+        ConfigRegistry: Configuration data.
     """
-    with open(config_path, 'r') as config_file:
-        return json.load(config_file)
+    return get_registry(config_path)
 
 def get_directories(folder_path):
     """
@@ -50,72 +60,181 @@ def get_directories(folder_path):
     """
     return [d for d in folder_path.iterdir() if d.is_dir()]
 
-def process_file(file, remove_rows, bad_lines_path):
+def process_file(file, remove_rows, writer, bad_lines_log, source=None):
     """
-    Process a single file by removing specified rows, checking for bad lines, and returning cleaned lines.
+    Stream a single file into the merged file, skipping the specified rows and logging bad lines.
+
+    The file is memory mapped and read from its first data row, so the preamble is never read
+    into Python and memory use does not depend on the size of the file.
 
     Args:
         file (Path): Path to the file to be processed.
         remove_rows (int): Number of rows to remove from the top of the file.
-        bad_lines_path (Path): Path to the bad lines log file.
+        writer (csv.writer): Writer of the merged file.
+        bad_lines_log (file): Open bad lines log file.
+        source (str): Manifest key of the file, added as the last field of every row.
 
     Returns:
-        list: List of cleaned lines.
+        int: Number of rows written to the merged file, or None if the file could not be read.
     """
     try:
-        # Read the file, skipping the specified number of rows
-        with file.open('r') as f:
-            lines = f.readlines()
-
-        # Remove the specified number of rows
-        lines = lines[remove_rows:]
-
-        # Write the modified lines back to the file
-        with file.open('w') as f:
-            f.writelines(lines)
-
-        # Check for bad lines and write them to bad_lines.txt
-        with file.open('r') as f:
-            reader = csv.reader(f)
-            lines = list(reader)
-
-        cleaned_lines = []
-        with open(bad_lines_path, 'a') as bad_lines_log:
-            for row in lines:
-                if len(row) != len(lines[0]):  # Check if the row length matches the header length
+        rows_written = 0
+        with open_statement(file, remove_rows) as f:
+            # Check every row against the length of the first one as they are read
+            header_length = None
+            for row in csv.reader(f):
+                if header_length is None:
+                    header_length = len(row)
+                if len(row) != header_length:
                     bad_lines_log.write(f"{file}: {row}\n")  # Log bad lines
                 else:
-                    cleaned_lines.append(row)  # Add valid rows to the cleaned_lines list
-
-        # Remove the old file
-        file.unlink()
-        return cleaned_lines
+                    writer.writerow(row + [source] if source else row)  # Write valid rows straight to the merged file
+                    rows_written += 1
+        return rows_written
 
     except Exception as e:
         print(f"Error processing file {file}: {e}")
-        return []
+        return None
+
+def read_header(file):
+    """Return the first row of a CSV file, or None if it is empty or cannot be read."""
+    try:
+        with open_statement(file) as f:
+            return next(csv.reader(f), None)
+    except (OSError, UnicodeDecodeError, csv.Error):
+        # Left for process_file, which reports the file and leaves it out of the manifest
+        return None
 
-def merge_files(directory, config, all_lines):
+def merge_files(directory, config, bad_lines_log, imported=frozenset()):
     """
-    Merge all cleaned lines into a new file and add a header if specified.
+    Stream every new file in the directory into a new merged file, adding a header if specified.
+
+    The input files are only removed once the merged file has replaced the old one, so a run that
+    stops halfway leaves the directory as it was. A merged file left by a run that stopped before
+    the file cleaner is recognized by its header and copied over as it is.
 
     Args:
         directory (Path): Path to the directory containing the files.
         config (dict): Configuration data for the directory.
-        all_lines (list): List of all cleaned lines to be merged.
+        bad_lines_log (file): Open bad lines log file.
+        imported (set): Manifest keys of the files that have already been imported.
+
+    Returns:
+        dict: Pending manifest entries of the merged files, by manifest key. The statements of an
+        earlier merged file have None, their entry is kept from the manifest.
     """
-    merged_file_path = directory / f"{config['type']}_{config['bank']}_{config['card']}.csv"
-    with merged_file_path.open('w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerows(all_lines)
+    account = f"{config['type']}_{config['bank']}_{config['card']}"
+    entries = {}
+
+    # List the files first so the merged file being written is not picked up
+    files = [file for file in directory.iterdir() if file.is_file() and file.suffix != '.tmp']
+    merged_header = config['add_header'] + [SOURCE_COLUMN] if 'add_header' in config else None
+
+    # Write to a temporary file since an input file may have the same name as the merged file
+    merged_file_path = directory / f"{account}.csv"
+    temp_file_path = merged_file_path.with_suffix('.tmp')
+    merged = []
+    with temp_file_path.open('w') as f:
+        # Add header if specified
+        if 'add_header' in config:
+            f.write(','.join(config['add_header'] + [SOURCE_COLUMN]) + '\n')
+
+        writer = csv.writer(f, lineterminator='\n')
+        for file in files:
+            digest = file_hash(file)
+            key = manifest_key(account, digest)
+
+            # Skip statements that were already imported, in an earlier run or earlier in this one
+            if key in imported or key in entries:
+                merged.append(file)
+                continue
+
+            # Rows of an earlier merged file already carry the manifest key of their statement
+            if merged_header is not None and read_header(file) == merged_header:
+                with open_statement(file, 1) as rows:
+                    for row in csv.reader(rows):
+                        writer.writerow(row)
+                        entries.setdefault(row[-1], None)
+                merged.append(file)
+                continue
+
+            # A file that could not be read is left out of the manifest, so it is imported again next time
+            if process_file(file, config['remove_rows'], writer, bad_lines_log, key) is not None:
+                merged.append(file)
+                entries[key] = {"account": account, "file": file.name, "sha256": digest, "first_row": None, "row_count": None}
+
+    temp_file_path.replace(merged_file_path)
+
+    # Remove the input files now that their rows are in the merged file
+    for file in merged:
+        if file != merged_file_path:
+            file.unlink()
+    return entries
+
+def merge_directory(directory, config, imported):
+    """
+    Merge a single account directory, run in a worker process.
 
-    # Add header if specified
-    if 'add_header' in config:
-        with merged_file_path.open('r') as f:
-            lines = f.readlines()
-        lines.insert(0, ','.join(config['add_header']) + '\n')
-        with merged_file_path.open('w') as f:
-            f.writelines(lines)
+    Args:
+        directory (Path): Path to the account directory.
+        config (dict): Configuration data for the directory.
+        imported (set): Manifest keys of the files that have already been imported.
+
+    Returns:
+        tuple: The bad lines found in the directory and the pending manifest entries of its files.
+    """
+    bad_lines_log = io.StringIO()
+    entries = merge_files(directory, config, bad_lines_log, imported)
+    return bad_lines_log.getvalue(), entries
+
+@stage("file_merger")
+def merge_accounts(folder_path, config_data):
+    """
+    Merge every account directory in the Data folder based on its configuration.
+
+    Args:
+        folder_path (Path): Path to the Data folder.
+        config_data (ConfigRegistry): Configuration entries from config.json.
+    """
+    config_data = as_registry(config_data)
+
+    # List all directories in the specified folder path
+    directories = get_directories(folder_path)
+
+    # Match each directory with its configuration, sorted so the bad lines are always in the same order
+    jobs = []
+    for directory in sorted(directories):
+        directory_formatted = directory.name.replace(' ', '_')
+        config = config_data.folder(directory_formatted)
+        if config is not None:
+            jobs.append((directory, config))
+
+    # Drop the pending entries of an earlier run that never finished so those files are imported again,
+    # unless their rows are still in a merged file of that run
+    manifest_path = folder_path / MANIFEST_FILE
+    earlier_manifest = load_manifest(manifest_path)
+    imported = imported_keys(earlier_manifest)
+    manifest = {key: entry for key, entry in earlier_manifest.items() if key in imported}
+
+    # Merge every account directory in its own worker and append their bad lines in directory order
+    bad_lines_path = folder_path / 'bad_lines.txt'
+    with open(bad_lines_path, 'a') as bad_lines_log:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+                directories, configs = zip(*jobs)
+                for bad_lines, entries in executor.map(merge_directory, directories, configs, [imported] * len(jobs)):
+                    bad_lines_log.write(bad_lines)
+                    count("bad_lines", bad_lines.count('\n'))
+                    for key, entry in entries.items():
+                        # Statements of an earlier merged file keep their pending entry
+                        if entry is None:
+                            account, digest = key.split('/', 1)
+                            entry = earlier_manifest.get(key, {"account": account, "file": None, "sha256": digest,
+                                                               "first_row": None, "row_count": None})
+                        manifest[key] = entry
+
+    # Save the new files as pending until their rows are appended to clean.csv
+    save_manifest(manifest_path, manifest)
 
 def main():
     """
@@ -132,27 +251,7 @@ def main():
     config_path = current_dir / 'Configs' / 'config.json'
     config_data = load_config(config_path)
 
-    # Create a dictionary to map folder names to their configurations
-    folder_config = {f"{entry['type']}_{entry['bank']}_{entry['card']}": entry for entry in config_data}
-
-    # List all directories in the specified folder path
-    directories = get_directories(folder_path)
-
-    # Iterate through each directory and apply the remove_rows value to the files
-    for directory in directories:
-        directory_formatted = directory.name.replace(' ', '_')
-        if directory_formatted in folder_config:
-            config = folder_config[directory_formatted]
-            remove_rows = config['remove_rows']
-            bad_lines_path = folder_path / 'bad_lines.txt'
-            all_lines = []
-
-            for file in directory.iterdir():
-                if file.is_file():
-                    cleaned_lines = process_file(file, remove_rows, bad_lines_path)
-                    all_lines.extend(cleaned_lines)
-
-            merge_files(directory, config, all_lines)
+    merge_accounts(folder_path, config_data)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Author: Adrien Protzel
+
+This module detects the account of a statement from its first lines, so a file no longer depends
+on the Type, Bank and Card picked by hand to go through the right remove_rows and add_header.
+
+The first rows of a file are read into a fingerprint: the number of preamble rows before the
+first row with a date and an amount, the number of columns of the data rows, the columns that hold
+dates and amounts, and the text of the header row right before the data. The fingerprint of every
+sample statement in Backup Data/Raw is precomputed into a signature table, with the account of the
+sample found from its file or folder name, so detecting a file costs one read of its first lines
+and a dictionary lookup. A file whose header text is not in the table is matched on the other
+parts of its fingerprint, and accounts without a sample on the remove_rows and add_header of their
+entry in config.json.
+
+A fingerprint can match several accounts, e.g. the Chase credit cards all share one export format.
+Every matching entry is returned, and a file is only routed by its fingerprint when exactly one
+account matches; an ambiguous file is flagged for the user instead of guessed.
+
+Modules used:
+- csv: For reading the first rows of a file.
+- itertools: For reading only the first rows.
+- os: For interacting with the operating system.
+- re: For matching dates, amounts and file names.
+
+Functions:
+- fingerprint(rows): Returns the preamble, columns, date columns, amount columns and header of the first rows of a file.
+- read_fingerprint(file_path): Returns the fingerprint of a statement file.
+- entry_from_name(name, configs): Returns the entry of the account a file or folder name starts with.
+- get_signature_table(configs, sample_dir): Returns the signature table of the configuration, rebuilding it when config.json changes.
+- detect_format(file_path, configs): Returns the entries of every account whose format matches a statement file.
+
+Classes:
+- SignatureTable: The fingerprints of the sample statements, with the accounts they belong to.
+"""
+
+import csv
+import itertools
+import os
+import re
+from config_registry import get_registry, folder_name
+from statement_reader import open_statement
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(current_dir, 'Backup Data', 'Raw')
+
+# Number of rows read from the top of a file, enough for the longest preamble in config.json
+SAMPLE_ROWS = 16
+
+DATE_PATTERN = re.compile(r'\d{1,2}/\d{1,2}/(\d{4}|\d{2})|\d{4}-\d{2}-\d{2}')
+# Amounts always have cents, so reference numbers and check numbers are not taken for amounts
+AMOUNT_PATTERN = re.compile(r'[-+]?\$?(\d{1,3}(,\d{3})+|\d+)\.\d{2}')
+
+def fingerprint(rows):
+    """
+    Return the fingerprint of the first rows of a file.
+
+    The first row with both a date and an amount is the first data row. The date and amount
+    columns are taken from every data row read, since some columns are empty in some rows,
+    e.g. the amount of the beginning balance.
+
+    Args:
+        rows (list): The first rows of the file, as lists of fields.
+
+    Returns:
+        tuple: The number of preamble rows, the number of columns, the date columns, the amount
+        columns and the header text (None for a file without a header), or None if no data row was found.
+    """
+    preamble = None
+    dates = set()
+    amounts = set()
+    for index, row in enumerate(rows):
+        fields = [field.strip() for field in row]
+        row_dates = {column for column, field in enumerate(fields) if DATE_PATTERN.fullmatch(field)}
+        row_amounts = {column for column, field in enumerate(fields) if AMOUNT_PATTERN.fullmatch(field)}
+        if not row_dates or not row_amounts:
+            continue
+        if preamble is None:
+            preamble = index
+            columns = len(fields)
+        dates |= row_dates
+        amounts |= row_amounts - row_dates
+
+    if preamble is None:
+        return None
+    header = ",".join(field.strip().lower() for field in rows[preamble - 1]) if preamble else None
+    return preamble, columns, tuple(sorted(dates)), tuple(sorted(amounts)), header
+
+def read_fingerprint(file_path):
+    """Return the fingerprint of a statement file from its first SAMPLE_ROWS rows, or None if it has no data row."""
+    with open_statement(file_path) as stream:
+        return fingerprint(list(itertools.islice(csv.reader(stream), SAMPLE_ROWS)))
+
+def entry_from_name(name, configs):
+    """
+    Return the entry of the account a file or folder name starts with, e.g. 'Credit Chase Freedom.CSV'.
+
+    Args:
+        name (str): File or folder name.
+        configs (ConfigRegistry): Configuration entries from config.json.
+
+    Returns:
+        dict: The configuration entry, or None if the name does not start with an account.
+    """
+    words = [word.lower() for word in re.split(r'[\s_\-.]+', os.path.splitext(name)[0]) if word]
+    for entry in configs:
+        if words[:3] == [entry['type'].lower(), entry['bank'].lower(), entry['card'].lower()]:
+            return entry
+    return None
+
+class SignatureTable:
+    """
+    The fingerprints of the sample statements, with the accounts they belong to.
+
+    Fingerprints are looked up with their header text first, then without it, so a bank that
+    renames a column still matches on its layout. A sample whose header was already rewritten to
+    the add_header of its account does not show the header of the bank, so it matches every file
+    with its layout, whatever the header text.
+    """
+
+    def __init__(self, configs, sample_dir=SAMPLE_DIR):
+        """
+        Fingerprint every sample statement whose file or folder name starts with an account.
+
+        Args:
+            configs (ConfigRegistry): Configuration entries from config.json.
+            sample_dir (str): Folder of the sample statements.
+        """
+        self.configs = configs
+        self.signatures = {}
+        self.layouts = {}
+        self.any_header = {}
+        sampled = set()
+        names = sorted(os.listdir(sample_dir)) if os.path.isdir(sample_dir) else []
+        for name in names:
+            entry = entry_from_name(name, configs)
+            if entry is None:
+                continue
+            path = os.path.join(sample_dir, name)
+            files = [os.path.join(path, file) for file in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+            for file_path in files:
+                signature = read_fingerprint(file_path)
+                if signature is None:
+                    continue
+                rewritten = signature[4] == ",".join(entry['add_header']).lower()
+                tables = [(self.layouts, signature[:4])]
+                tables.append((self.any_header, signature[:4]) if rewritten else (self.signatures, signature))
+                for table, key in tables:
+                    folders = table.setdefault(key, [])
+                    if folder_name(entry) not in folders:
+                        folders.append(folder_name(entry))
+                sampled.add(folder_name(entry))
+        self.unsampled = [entry for entry in configs if folder_name(entry) not in sampled]
+
+    def match(self, signature):
+        """
+        Return the entries of every account a fingerprint matches, in config.json order.
+
+        Args:
+            signature (tuple): Fingerprint of a file.
+
+        Returns:
+            list: The matching configuration entries, empty if the format is unknown.
+        """
+        if signature is None:
+            return []
+        folders = self.signatures.get(signature)
+        if folders is not None:
+            folders = folders + self.any_header.get(signature[:4], [])
+        else:
+            folders = self.layouts.get(signature[:4], []) + [folder_name(entry) for entry in self.unsampled
+                                                             if self.fits_config(entry, signature)]
+        return [entry for entry in self.configs if folder_name(entry) in folders]
+
+    @staticmethod
+    def fits_config(entry, signature):
+        """Return whether a fingerprint fits the remove_rows and add_header of an entry without a sample."""
+        preamble, columns, dates, amounts, _ = signature
+        header = entry['add_header']
+        return (preamble == entry['remove_rows'] and columns >= len(header)
+                and header.index('Date') in dates and header.index('Amount') in amounts)
+
+# Signature tables by sample folder, with the registry they were built from
+_tables = {}
+
+def get_signature_table(configs=None, sample_dir=SAMPLE_DIR):
+    """Return the signature table of the configuration, rebuilding it only when config.json has changed."""
+    configs = configs if configs is not None else get_registry()
+    cached = _tables.get(sample_dir)
+    if cached is None or cached[0] is not configs:
+        cached = (configs, SignatureTable(configs, sample_dir))
+        _tables[sample_dir] = cached
+    return cached[1]
+
+def detect_format(file_path, configs=None):
+    """
+    Return the entries of every account whose format matches a statement file.
+
+    Args:
+        file_path (str): Path to the statement file.
+        configs (ConfigRegistry): Configuration entries from config.json, the default file if None.
+
+    Returns:
+        list: The matching configuration entries. One entry is a match, several are ambiguous and
+        should be confirmed by the user, and none means the format is unknown.
+    """
+    table = get_signature_table(configs)
+    try:
+        signature = read_fingerprint(file_path)
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return []
+    return table.match(signature)
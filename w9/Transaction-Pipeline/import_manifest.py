@@ -0,0 +1,86 @@
+"""
+Author: Adrien Protzel
+
+This module keeps a manifest of every imported statement file, keyed by its account and the
+SHA-256 hash of its content, so a run only processes statements that have not been imported yet.
+
+Each entry records the rows the file produced in clean.csv. An entry is added as pending when the
+file is merged and completed once its rows have been appended to clean.csv, so a run that fails
+in between imports the file again next time.
+
+Modules used:
+- hashlib: For hashing the file contents.
+- json: For reading and writing the manifest.
+- os: For interacting with the operating system.
+- pandas: For finding the rows of each file.
+
+Functions:
+- file_hash(file_path): Returns the SHA-256 hash of a file, read in chunks.
+- manifest_key(account, digest): Returns the manifest key of a file.
+- load_manifest(manifest_path): Loads the manifest, or an empty one if it does not exist.
+- save_manifest(manifest_path, manifest): Saves the manifest through a temporary file.
+- imported_keys(manifest): Returns the keys of the files whose rows are already in clean.csv.
+- record_clean_rows(manifest, sources, first_row): Records the clean.csv rows produced by each pending file.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+# Name of the manifest file in the Data folder
+MANIFEST_FILE = 'manifest.json'
+
+# Name of the column that carries the manifest key of each row until clean.csv is written
+SOURCE_COLUMN = 'Source'
+
+def file_hash(file_path):
+    """Return the SHA-256 hash of a file, read in chunks so large files are never fully loaded."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def manifest_key(account, digest):
+    """Return the manifest key of a file from its account folder name and content hash."""
+    return f"{account}/{digest}"
+
+def load_manifest(manifest_path):
+    """Load the manifest, or return an empty one if it does not exist yet."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    """Save the manifest to a temporary file first so a crash never leaves it half written."""
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_path, manifest_path)
+
+def imported_keys(manifest):
+    """Return the keys of the files whose rows have already been appended to clean.csv."""
+    return {key for key, entry in manifest.items() if entry.get('first_row') is not None}
+
+def record_clean_rows(manifest, sources, first_row):
+    """
+    Record the clean.csv rows produced by each pending file.
+
+    Args:
+        manifest (dict): The manifest to update.
+        sources (Series): Manifest key of every row appended to clean.csv, in file order.
+        first_row (int): Row number in clean.csv of the first appended row, not counting the header.
+    """
+    # Rows of a file stay together through the pipeline, so each file is a single range
+    positions = pd.RangeIndex(len(sources)).to_series().groupby(sources.to_numpy()).agg(['min', 'count'])
+
+    for key, entry in manifest.items():
+        if entry.get('first_row') is None:
+            if key in positions.index:
+                entry['first_row'] = first_row + int(positions.at[key, 'min'])
+                entry['row_count'] = int(positions.at[key, 'count'])
+            else:
+                entry['first_row'] = first_row
+                entry['row_count'] = 0
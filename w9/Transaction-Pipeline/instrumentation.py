@@ -0,0 +1,236 @@
+"""
+Author: Adrien Protzel
+
+This module measures the pipeline stages and writes a run report, so a slow run shows which stage
+the time goes to.
+
+Every stage function is wrapped with the stage decorator, which records its wall time, CPU time,
+rows in and out, bytes read and written and how much it raised the peak memory of the process. The
+peak memory is process-wide, so a stage that runs after a heavier one raises it by 0, and the peak of
+the whole run is reported once at the top of the report. The stages also count
+events such as bad lines and unmatched descriptions. Stages that run in worker processes send their
+measurements back with their result, and the parent adds them to its own, so their wall and CPU
+times are the sums over the workers. Instrumentation is off unless the
+PIPELINE_REPORT environment variable is set to 1 or enable() is called, and a disabled stage only
+costs a single flag check.
+
+Modules used:
+- functools: For keeping the names of the wrapped functions.
+- json: For writing the run report.
+- os: For interacting with the operating system.
+- sys: For checking the platform.
+- time: For timing the stages.
+- resource: For the peak memory of the process (not available on Windows).
+
+Functions:
+- enable(): Turns instrumentation on for the rest of the run.
+- is_enabled(): Returns whether instrumentation is on.
+- stage(name): Decorator that measures every call of a stage function.
+- count(name, amount): Adds to a counter of the current stage.
+- collect(): Returns the measurements taken so far in this process and starts over.
+- merge(measurements): Adds the measurements of a worker process to the stages of this one.
+- build_report(): Returns the run report as a dictionary.
+- write_report(report_dir): Writes the run report as JSON and returns its path.
+"""
+
+import functools
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+enabled = os.environ.get('PIPELINE_REPORT') == '1'
+
+# Measurements by stage name, in the order the stages were first called
+stages = {}
+
+# Names of the stages that are running, the innermost last
+running = []
+
+run_started = time.time()
+
+def enable():
+    """Turn instrumentation on for the rest of the run."""
+    global enabled
+    enabled = True
+
+def is_enabled():
+    """Return whether instrumentation is on."""
+    return enabled
+
+def peak_rss_mb():
+    """Return the peak resident memory of the process in MB, or None if it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 2)
+
+def io_bytes():
+    """Return the bytes read and written by the process so far, or (None, None) if not available."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def row_count(value):
+    """Return the number of rows of a dataframe or list, or None for anything else."""
+    if hasattr(value, 'shape'):
+        return int(value.shape[0])
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+def record(name):
+    """Return the measurements of a stage, creating them on its first call."""
+    if name not in stages:
+        stages[name] = {
+            "calls": 0,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "rows_in": None,
+            "rows_out": None,
+            "bytes_read": None,
+            "bytes_written": None,
+            "peak_rss_growth_mb": None,
+            "counters": {},
+        }
+    return stages[name]
+
+def add(totals, key, value):
+    """Add a value to a measurement that may still be None."""
+    if value is not None:
+        totals[key] = (totals[key] or 0) + value
+
+def stage(name):
+    """
+    Decorator that measures every call of a stage function when instrumentation is on.
+
+    Args:
+        name (str): Name of the stage in the run report.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            rows_in = next((row_count(arg) for arg in args if hasattr(arg, 'shape')), None)
+            peak_before = peak_rss_mb()
+            read_before, written_before = io_bytes()
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            running.append(name)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                running.pop()
+                totals = record(name)
+                totals["calls"] += 1
+                totals["wall_seconds"] += time.perf_counter() - start_wall
+                totals["cpu_seconds"] += time.process_time() - start_cpu
+                read_after, written_after = io_bytes()
+                if read_before is not None and read_after is not None:
+                    add(totals, "bytes_read", read_after - read_before)
+                    add(totals, "bytes_written", written_after - written_before)
+                # Only the increase of the process peak is the stage's own, the peak itself may be from an earlier stage
+                peak_after = peak_rss_mb()
+                if peak_before is not None and peak_after is not None:
+                    totals["peak_rss_growth_mb"] = max(totals["peak_rss_growth_mb"] or 0, round(peak_after - peak_before, 2))
+                add(totals, "rows_in", rows_in)
+            add(totals, "rows_out", row_count(result))
+            return result
+        return wrapper
+    return decorator
+
+def count(name, amount=1):
+    """
+    Add to a counter of the current stage, e.g. bad lines or unmatched descriptions.
+
+    Args:
+        name (str): Name of the counter.
+        amount (int): Amount to add.
+    """
+    if not enabled:
+        return
+    counters = record(running[-1] if running else "pipeline")["counters"]
+    counters[name] = counters.get(name, 0) + int(amount)
+
+def collect():
+    """
+    Return the measurements taken so far in this process and start over.
+
+    A worker process calls it before a task, to drop the measurements it inherited from the
+    parent, and after it, to send the measurements of the task back with its result.
+
+    Returns:
+        dict: Measurements by stage name, empty when instrumentation is off.
+    """
+    global stages
+    measurements, stages = stages, {}
+    return measurements
+
+def merge(measurements):
+    """
+    Add the measurements of a worker process to the stages of this one.
+
+    Args:
+        measurements (dict): Measurements by stage name, as returned by collect() in the worker.
+    """
+    for name, worker_totals in measurements.items():
+        totals = record(name)
+        totals["calls"] += worker_totals["calls"]
+        totals["wall_seconds"] += worker_totals["wall_seconds"]
+        totals["cpu_seconds"] += worker_totals["cpu_seconds"]
+        for key in ("rows_in", "rows_out", "bytes_read", "bytes_written"):
+            add(totals, key, worker_totals[key])
+        # The increase of the peak of a single process, the largest over the workers
+        if worker_totals["peak_rss_growth_mb"] is not None:
+            totals["peak_rss_growth_mb"] = max(totals["peak_rss_growth_mb"] or 0, worker_totals["peak_rss_growth_mb"])
+        for counter, amount in worker_totals["counters"].items():
+            totals["counters"][counter] = totals["counters"].get(counter, 0) + amount
+
+def build_report():
+    """Return the run report with the measurements of every stage and the run totals."""
+    counters = {}
+    for totals in stages.values():
+        for name, amount in totals["counters"].items():
+            counters[name] = counters.get(name, 0) + amount
+
+    report_stages = {}
+    for name, totals in stages.items():
+        report_stages[name] = dict(totals, wall_seconds=round(totals["wall_seconds"], 4),
+                                   cpu_seconds=round(totals["cpu_seconds"], 4))
+
+    return {
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(run_started)),
+        "wall_seconds": round(time.time() - run_started, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "counters": counters,
+        "stages": report_stages,
+    }
+
+def write_report(report_dir):
+    """
+    Write the run report as JSON.
+
+    Args:
+        report_dir (str): Path to the folder for the run reports.
+
+    Returns:
+        str: Path to the report, or None if instrumentation is off.
+    """
+    if not enabled:
+        return None
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"run_{time.strftime('%Y%m%d_%H%M%S', time.localtime(run_started))}.json")
+    with open(report_path, 'w') as f:
+        json.dump(build_report(), f, indent=4)
+    return report_path
@@ -0,0 +1,137 @@
+"""
+Author: Adrien Protzel
+
+This module compiles a keyword map file (keyword,value per line) into an Aho-Corasick automaton
+so every keyword can be searched for in a description with a single pass over its characters.
+The compiled maps are cached by the modification time of the map file, so they are only rebuilt
+when a new mapping is added.
+
+Modules used:
+- csv: For reading the map files, where keywords with a comma are quoted.
+- os: For reading the modification time of the map files.
+- collections: For the breadth-first queue used to build the automaton.
+
+Functions:
+- load_keyword_map(map_file_path): Loads a keyword map file into an ordered dictionary.
+- get_keyword_map(map_file_path): Returns the compiled keyword map of a file, rebuilding it when the file changes.
+
+Classes:
+- KeywordMap: An ordered keyword map compiled into an Aho-Corasick automaton.
+"""
+
+import csv
+import os
+from collections import deque
+
+class KeywordMap:
+    """
+    An ordered keyword map compiled into an Aho-Corasick automaton.
+
+    When several keywords occur in a description, the keyword that comes first in the
+    map file wins, the same as checking the keywords one by one in file order.
+    """
+
+    def __init__(self, keyword_map):
+        """
+        Build the automaton for the keywords of the map.
+
+        Args:
+            keyword_map (dict): Keywords mapped to their values, in file order.
+        """
+        self.keywords = list(keyword_map.keys())
+        self.values = list(keyword_map.values())
+
+        # First index of every value, used to skip descriptions that are already a mapped value
+        self.value_index = {}
+        for index, value in enumerate(self.values):
+            self.value_index.setdefault(value, index)
+
+        # goto[state] maps a character to the next state, first[state] is the lowest keyword
+        # index that ends at the state (following the failure links), or None
+        self.goto = [{}]
+        self.first = [None]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.first.append(None)
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            if self.first[state] is None:
+                self.first[state] = index
+
+        # Breadth-first pass to set the failure links and merge the matches they lead to
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.first[next_state] = _lowest(self.first[next_state], self.first[self.fail[next_state]])
+                queue.append(next_state)
+
+    def first_keyword(self, text):
+        """Return the index of the first keyword in file order that occurs in the text, or None."""
+        goto, fail, first = self.goto, self.fail, self.first
+        best = first[0]
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if first[state] is not None and (best is None or first[state] < best):
+                best = first[state]
+                if best == 0:
+                    break
+        return best
+
+    def lookup(self, text, match_values=False):
+        """
+        Return the value of the first keyword in file order that occurs in the text.
+
+        Args:
+            text (str): The description to look up.
+            match_values (bool): Also stop at the first entry whose value equals the text exactly.
+
+        Returns:
+            str: The mapped value, or None if nothing matches.
+        """
+        index = self.first_keyword(text)
+        if match_values:
+            index = _lowest(index, self.value_index.get(text))
+        return None if index is None else self.values[index]
+
+def _lowest(a, b):
+    """Return the lower of two keyword indexes, either of which may be None."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+def load_keyword_map(map_file_path):
+    """Load a keyword map file into an ordered dictionary."""
+    keyword_map = {}
+    with open(map_file_path, 'r', newline='') as f:
+        # Only the line is stripped, spaces at the end of a keyword or value are part of it
+        for parts in csv.reader(line.strip() for line in f):
+            if len(parts) == 2:
+                keyword_map[parts[0]] = parts[1]
+    return keyword_map
+
+# Compiled keyword maps by file path, with the file state they were built from
+_compiled_maps = {}
+
+def get_keyword_map(map_file_path):
+    """Return the compiled keyword map of a file, rebuilding it only when the file has changed."""
+    stat = os.stat(map_file_path)
+    file_state = (stat.st_mtime_ns, stat.st_size)
+    cached = _compiled_maps.get(map_file_path)
+    if cached is None or cached[0] != file_state:
+        cached = (file_state, KeywordMap(load_keyword_map(map_file_path)))
+        _compiled_maps[map_file_path] = cached
+    return cached[1]
@@ -1,24 +1,163 @@
 """
 Author: Adrien Protzel
 
-This program sequentially calls other scripts to import, manage, and clean data.
+This program sequentially calls the other stages to import, manage, and clean data.
+
+Every stage runs in this process and the cleaning stages pass a single in-memory dataframe
+from one to the next. Besides appending the new rows to clean.csv, the dataframe is only written
+to the Data folder after the stages listed in CHECKPOINTS.
+
+Every completed stage is recorded in the stage journal, with the dataframe of the stages listed in
+RESUME_STAGES. A run that fails or is cancelled halfway through is resumed from its last
+completed stage the next time main.py is run.
+
+The watch daemon runs the same stages through run_pipeline without any window, after moving the
+statements dropped in its inbox to the Data folder.
 """
 
-import subprocess
 import os
+from pathlib import Path
+import file_merger
+import file_cleaner
+import desc_cleaner
+import cat_cleaner
+import dedup_index
+import instrumentation
+from transaction_schema import write_transactions
+from review_queue import ReviewQueue
+from bad_lines_cleaner import commit_bad_lines
+from stage_journal import StageJournal
+from config_registry import get_registry
 
-if __name__ == "__main__":
-    # Get the directory of the current script
-    current_dir = os.path.dirname(os.path.abspath(__file__))
+# Stages the journal keeps the dataframe of, so a resumed run starts after them. The description
+# and category stages are run again since their review queue only lives in memory.
+RESUME_STAGES = ("file_cleaner", "review")
+
+# Stages after which the dataframe is written to the Data folder, mapped to the output file name,
+# e.g. {"file_cleaner": "dirty.csv", "desc_cleaner": "desc.csv"}
+CHECKPOINTS = {}
+
+def checkpoint(df, stage, data_dir):
+    """Write the dataframe to disk if the stage is a configured checkpoint."""
+    if stage in CHECKPOINTS:
+        write_transactions(df, os.path.join(data_dir, CHECKPOINTS[stage]))
+
+def remove_checkpoints(data_dir):
+    """Remove the intermediate checkpoint files so the next run does not merge them again."""
+    for file_name in CHECKPOINTS.values():
+        path = os.path.join(data_dir, file_name)
+        if file_name != 'clean.csv' and os.path.exists(path):
+            os.remove(path)
+
+def restore_file_size(file_path, size):
+    """Cut a file back to the size it had before a write that did not finish, or remove it if it did not exist."""
+    if size is None:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    elif os.path.exists(file_path) and os.path.getsize(file_path) > size:
+        with open(file_path, 'r+b') as f:
+            f.truncate(size)
+
+def run_cleaning_stages(data_dir, configs, journal=None, interactive=True):
+    """
+    Run the cleaning stages in this process, passing the dataframe from stage to stage.
+
+    Args:
+        data_dir (str): Path to the Data folder.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        journal (StageJournal): Journal of the run to resume from and record the stages in, or None.
+        interactive (bool): Show the bad lines and review windows. Without a desktop session, the
+            bad lines that need manual entry are kept for later and the review is skipped.
+
+    Returns:
+        DataFrame: The clean transactions.
+    """
+    # The description and category stages only queue their unmatched descriptions, which are
+    # all reviewed in one window once the automatic stages are done
+    queue = ReviewQueue(interactive)
+    stages = [
+        ("file_cleaner", lambda df: file_cleaner.clean_files(data_dir, configs, journal is None, interactive,
+                                                                     CHECKPOINTS.values())),
+        ("dedup_index", lambda df: dedup_index.remove_duplicates(df, data_dir)),
+        ("desc_cleaner", lambda df: desc_cleaner.clean_descriptions(df, queue)),
+        ("cat_cleaner", lambda df: cat_cleaner.categorize_descriptions(df, queue)),
+        ("review", queue.review),
+    ]
+
+    start, df = 0, None
+    if journal is not None:
+        start, df = journal.resume([stage for stage, _ in stages])
+
+    for stage, function in stages[start:]:
+        df = function(df)
+        checkpoint(df, stage, data_dir)
+        if journal is not None:
+            journal.complete(stage, df if stage in RESUME_STAGES else None)
+
+    # The account files and the bad lines that were read are only removed once the journal has
+    # the cleaned transactions
+    if journal is not None:
+        file_cleaner.remove_account_files(data_dir)
+        commit_bad_lines(Path(data_dir) / 'bad_lines.txt')
+
+    # Append the new rows to clean.csv, undoing the rows of an append that did not finish
+    clean_file_path = os.path.join(data_dir, 'clean.csv')
+    if journal is not None:
+        if "clean_bytes" in journal.info("write_clean_file"):
+            restore_file_size(clean_file_path, journal.info("write_clean_file")["clean_bytes"])
+        clean_bytes = os.path.getsize(clean_file_path) if os.path.exists(clean_file_path) else None
+        journal.start("write_clean_file", clean_bytes=clean_bytes)
+    file_cleaner.write_clean_file(df, data_dir, journal.run_id if journal is not None else None)
+
+    # Remove the intermediate files, the run is complete
+    remove_checkpoints(data_dir)
+    if journal is not None:
+        journal.finish()
+    return df
+
+def run_pipeline(data_dir, configs, interactive=True):
+    """
+    Run every stage of the pipeline, resuming the last run if it did not finish.
+
+    Args:
+        data_dir (str): Path to the Data folder.
+        configs (ConfigRegistry): Configuration entries from config.json.
+        interactive (bool): Ask the user to import files and show the bad lines and review windows.
+            The watch daemon runs without them, after moving the new files to the Data folder itself.
+    """
+    journal = StageJournal(data_dir)
+    if journal.resumed:
+        print("Resuming the unfinished run......")
 
     # Ask user to import files and to which folder <Type>_<Bank>_<Card>
-    subprocess.run(["python", os.path.join(current_dir, "file_importer.py")])
+    if not journal.completed("file_importer"):
+        if interactive:
+            # Imported here since the importer opens Tk, which the watch daemon runs without
+            import file_importer
+            file_importer.main()
+        journal.complete("file_importer")
     print("File Importing......Done")
 
     # Cleans headers and merges multiple files in single bank account file
-    subprocess.run(["python", os.path.join(current_dir, "file_merger.py")])
+    if not journal.completed("file_merger"):
+        file_merger.convert_json_files(Path(data_dir))
+        file_merger.merge_accounts(Path(data_dir), configs)
+        journal.complete("file_merger")
     print("File Merging......Done")
 
     # Removes, renames, adds, splits columns, merges into single clean file in Clean folder
-    subprocess.run(["python", os.path.join(current_dir, "file_cleaner.py")])
+    run_cleaning_stages(data_dir, configs, journal, interactive)
     print("File Cleaning......Done")
+
+if __name__ == "__main__":
+    # Get the directory of the current script
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(current_dir, 'Data')
+
+    configs = get_registry(os.path.join(current_dir, 'Configs', 'config.json'))
+    run_pipeline(data_dir, configs)
+
+    # Writes the run report when PIPELINE_REPORT=1
+    report_path = instrumentation.write_report(os.path.join(current_dir, 'Reports'))
+    if report_path:
+        print(f"Run report saved to {report_path}")
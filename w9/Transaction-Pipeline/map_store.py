@@ -0,0 +1,300 @@
+"""
+Author: Adrien Protzel
+
+This module keeps the description and category maps in an embedded SQLite database, so the rules
+stay ordered, indexed and deduplicated as they grow, and two runs adding rules at the same time
+never corrupt them.
+
+Every rule has a position, and a description is matched against the rules in position order, the
+same as reading the text file from the top. Adding a keyword that already exists updates its
+value and keeps its position. Rules are added in batches, each batch in a single transaction, and
+after every batch the map is exported back to its text file in Configs/Maps so the rules can
+still be read and reviewed as before. Keywords with a comma are quoted in the text file.
+
+The first time the database is opened, each map is imported from its text file. The size and
+modification time of every text file are recorded when it is imported or exported, and a text file
+that was edited by hand since then is imported again, replacing the rules of its map, before the
+map is read or rules are added to it. Run this module to export the maps again, e.g. after
+restoring the database.
+
+Modules used:
+- csv: For reading and writing the text files.
+- os: For interacting with the operating system.
+- sqlite3: For storing the rules.
+
+Functions:
+- map_file_path(map_name, store_path): Returns the path to the text file of a map.
+- connect(store_path): Opens the map store, creating it from the text files the first time, and again when they were edited.
+- import_map_file(connection, map_name, file_path): Imports the rules of a text file at the end of a map.
+- file_state(file_path): Returns the modification time and size of a text file.
+- record_file_state(connection, map_name, file_path): Records the state of a text file after it is imported or exported.
+- file_changed(connection, map_name, file_path): Returns whether a text file was edited since it was last imported or exported.
+- sync_map_file(connection, map_name, store_path): Replaces the rules of a map with its text file if the file was edited.
+- refresh_map(map_name, store_path): Imports the text file of a map again if it was edited by hand.
+- insert_rules(connection, map_name, rules): Inserts rules at the end of a map, updating keywords that already exist.
+- load_rules(map_name, store_path): Loads the rules of a map in position order.
+- add_rules(map_name, rules, store_path): Adds a batch of rules to a map in one transaction.
+- map_version(connection, map_name): Returns the version of a map.
+- export_map(map_name, file_path, store_path): Writes a map to its text file.
+- get_keyword_map(map_name, store_path): Returns the compiled keyword map, rebuilding it when the map changes.
+- main(): Exports every map to its text file.
+"""
+
+import csv
+import os
+import sqlite3
+from keyword_matcher import KeywordMap, load_keyword_map
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+maps_dir = os.path.join(current_dir, 'Configs', 'Maps')
+
+# Database of the map store
+STORE_PATH = os.path.join(maps_dir, 'maps.sqlite3')
+
+# Names of the maps, each imported from and exported to <name>_map.txt next to the database
+DESCRIPTION_MAP = 'description'
+CATEGORY_MAP = 'category'
+MAP_NAMES = (DESCRIPTION_MAP, CATEGORY_MAP)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    map TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    keyword TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (map, keyword)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS rules_position ON rules (map, position);
+CREATE TABLE IF NOT EXISTS versions (
+    map TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    map TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+# Open connections by database path, reused for the whole run
+_connections = {}
+
+def map_file_path(map_name, store_path=STORE_PATH):
+    """Return the path to the text file of a map, next to the database."""
+    return os.path.join(os.path.dirname(os.path.abspath(store_path)), f"{map_name}_map.txt")
+
+def connect(store_path=STORE_PATH):
+    """
+    Open the map store, creating it and importing the text files the first time, and again when they were edited.
+
+    Args:
+        store_path (str): Path to the database.
+
+    Returns:
+        Connection: The connection to the map store.
+    """
+    connection = _connections.get(store_path)
+    if connection is not None:
+        return connection
+
+    # Wait for another run that is writing instead of failing, and let readers continue meanwhile
+    connection = sqlite3.connect(store_path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for map_name in MAP_NAMES:
+            connection.execute("INSERT OR IGNORE INTO versions (map, version) VALUES (?, 0)", (map_name,))
+            sync_map_file(connection, map_name, store_path)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    _connections[store_path] = connection
+    return connection
+
+def import_map_file(connection, map_name, file_path):
+    """
+    Import the rules of a text file at the end of a map, in file order.
+
+    Args:
+        connection (Connection): The connection to the map store, inside a transaction.
+        map_name (str): Name of the map.
+        file_path (str): Path to the text file.
+    """
+    insert_rules(connection, map_name, load_keyword_map(file_path).items())
+
+def file_state(file_path):
+    """Return the modification time and size of a text file, or None if it does not exist."""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def record_file_state(connection, map_name, file_path):
+    """Record the state of the text file of a map after it is imported or exported."""
+    state = file_state(file_path)
+    if state is not None:
+        connection.execute("INSERT OR REPLACE INTO files (map, mtime_ns, size) VALUES (?, ?, ?)", (map_name, *state))
+
+def file_changed(connection, map_name, file_path):
+    """Return whether the text file of a map was edited since it was last imported or exported."""
+    state = file_state(file_path)
+    if state is None:
+        return False
+    row = connection.execute("SELECT mtime_ns, size FROM files WHERE map = ?", (map_name,)).fetchone()
+    return row is None or tuple(row) != state
+
+def sync_map_file(connection, map_name, store_path=STORE_PATH):
+    """
+    Replace the rules of a map with its text file if the file was edited since it was last imported or exported.
+
+    The text file is read the same way as before the map store, so keywords that were removed,
+    reordered or changed by hand are removed, reordered or changed in the map.
+
+    Args:
+        connection (Connection): The connection to the map store, inside a transaction.
+        map_name (str): Name of the map.
+        store_path (str): Path to the database.
+
+    Returns:
+        bool: Whether the rules of the map changed.
+    """
+    file_path = map_file_path(map_name, store_path)
+    if not file_changed(connection, map_name, file_path):
+        return False
+
+    rules = load_keyword_map(file_path)
+    current = connection.execute("SELECT keyword, value FROM rules WHERE map = ? ORDER BY position", (map_name,))
+    changed = list(rules.items()) != list(current)
+    if changed:
+        connection.execute("DELETE FROM rules WHERE map = ?", (map_name,))
+        insert_rules(connection, map_name, rules.items())
+        connection.execute("UPDATE versions SET version = version + 1 WHERE map = ?", (map_name,))
+    record_file_state(connection, map_name, file_path)
+    return changed
+
+def refresh_map(map_name, store_path=STORE_PATH):
+    """Import the text file of a map again if it was edited by hand, e.g. while a long run was going on."""
+    connection = connect(store_path)
+    if not file_changed(connection, map_name, map_file_path(map_name, store_path)):
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        sync_map_file(connection, map_name, store_path)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+def insert_rules(connection, map_name, rules):
+    """
+    Insert rules after the last position of a map, updating the value of keywords that already exist.
+
+    Returns:
+        tuple: Number of new keywords and number of keywords whose value changed.
+    """
+    position = connection.execute("SELECT COALESCE(MAX(position), -1) FROM rules WHERE map = ?", (map_name,)).fetchone()[0]
+    added = 0
+    updated = 0
+    for keyword, value in rules:
+        existing = connection.execute("SELECT value FROM rules WHERE map = ? AND keyword = ?", (map_name, keyword)).fetchone()
+        if existing is None:
+            position += 1
+            connection.execute("INSERT INTO rules (map, position, keyword, value) VALUES (?, ?, ?, ?)",
+                                (map_name, position, keyword, value))
+            added += 1
+        elif existing[0] != value:
+            connection.execute("UPDATE rules SET value = ? WHERE map = ? AND keyword = ?", (value, map_name, keyword))
+            updated += 1
+    return added, updated
+
+def load_rules(map_name, store_path=STORE_PATH):
+    """Load the rules of a map into an ordered dictionary of keyword to value."""
+    rows = connect(store_path).execute("SELECT keyword, value FROM rules WHERE map = ? ORDER BY position", (map_name,))
+    return dict(rows)
+
+def map_version(connection, map_name):
+    """Return the version of a map, which changes with every batch of rules added to it."""
+    row = connection.execute("SELECT version FROM versions WHERE map = ?", (map_name,)).fetchone()
+    return None if row is None else row[0]
+
+def add_rules(map_name, rules, store_path=STORE_PATH):
+    """
+    Add a batch of rules to a map in one transaction and export the map to its text file.
+
+    Keywords and values are lowercased. A keyword that already exists keeps its position and
+    takes the new value, so adding the same rule twice changes nothing.
+
+    Args:
+        map_name (str): Name of the map.
+        rules (list): Pairs of keyword and value, in the order they should be matched.
+        store_path (str): Path to the database.
+
+    Returns:
+        int: Number of new keywords added to the map.
+    """
+    rules = [(keyword.lower(), value.lower()) for keyword, value in rules if keyword and value]
+    if not rules:
+        return 0
+
+    connection = connect(store_path)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        # Hand edits of the text file are imported first, so the export below does not overwrite them
+        sync_map_file(connection, map_name, store_path)
+        added, updated = insert_rules(connection, map_name, rules)
+        if added or updated:
+            connection.execute("UPDATE versions SET version = version + 1 WHERE map = ?", (map_name,))
+            # Exported while the write lock is held, so two runs never write the text file at once
+            export_map(map_name, map_file_path(map_name, store_path), store_path)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return added
+
+def export_map(map_name, file_path, store_path=STORE_PATH):
+    """
+    Write a map to a text file with one keyword,value line per rule, through a temporary file.
+
+    The state of the text file of the map is recorded, so the export is not taken for a hand edit.
+
+    Args:
+        map_name (str): Name of the map.
+        file_path (str): Path to the text file.
+        store_path (str): Path to the database.
+    """
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerows(load_rules(map_name, store_path).items())
+    os.replace(temp_path, file_path)
+    if os.path.abspath(file_path) == os.path.abspath(map_file_path(map_name, store_path)):
+        record_file_state(connect(store_path), map_name, file_path)
+
+# Compiled keyword maps by database and map name, with the version they were built from
+_compiled_maps = {}
+
+def get_keyword_map(map_name, store_path=STORE_PATH):
+    """Return the compiled keyword map of a map, rebuilding it only when rules have been added or its text file was edited."""
+    refresh_map(map_name, store_path)
+    version = map_version(connect(store_path), map_name)
+    cached = _compiled_maps.get((store_path, map_name))
+    if cached is None or cached[0] != version:
+        cached = (version, KeywordMap(load_rules(map_name, store_path)))
+        _compiled_maps[(store_path, map_name)] = cached
+    return cached[1]
+
+def main():
+    """Export every map in the map store to its text file, importing the hand edits first."""
+    for map_name in MAP_NAMES:
+        refresh_map(map_name)
+        export_map(map_name, map_file_path(map_name))
+        print(f"Exported {map_file_path(map_name)}")
+
+if __name__ == "__main__":
+    main()
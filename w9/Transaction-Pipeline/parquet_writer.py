@@ -0,0 +1,96 @@
+"""
+Author: Adrien Protzel
+
+This module writes the clean transactions to a typed Parquet dataset partitioned by Year and Month,
+next to clean.csv, so downstream readers can skip CSV parsing and only read the months they need.
+
+The column types follow the schema declared in PySpark/solution.py: integer Year and Day, a date
+for Date and a float for Amount, converted from the cents of the pipeline. Category, Type, Bank and Card are dictionary encoded.
+
+Modules used:
+- os: For interacting with the operating system.
+- time: For naming the files written by each run.
+- pandas: For data manipulation and analysis.
+- pyarrow: For writing the Parquet dataset (optional, the dataset is skipped without it).
+
+Functions:
+- to_arrow_table(df): Converts the clean transactions to an Arrow table with the dataset schema.
+- write_parquet_dataset(df, dataset_dir, run_id): Appends the clean transactions to the Parquet dataset.
+"""
+
+import os
+import time
+import pandas as pd
+from instrumentation import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+# Name of the Parquet dataset folder in the Data folder
+PARQUET_DIR = 'clean_parquet'
+
+if pa is not None:
+    # Dictionary encoded string type for the low cardinality columns
+    DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+    SCHEMA = pa.schema([
+        ("Year", pa.int32()),
+        ("Month", pa.string()),
+        ("Day", pa.int32()),
+        ("Date", pa.date32()),
+        ("Description", pa.string()),
+        ("Category", DICTIONARY),
+        ("Amount", pa.float32()),
+        ("Type", DICTIONARY),
+        ("Bank", DICTIONARY),
+        ("Card", DICTIONARY),
+    ])
+
+    PARTITIONING = ds.partitioning(pa.schema([("Year", pa.int32()), ("Month", pa.string())]), flavor="hive")
+
+def to_arrow_table(df):
+    """Convert the clean transactions to an Arrow table with the dataset schema."""
+    dates = df['Date']
+    columns = {
+        "Year": df['Year'].astype('int32'),
+        "Month": df['Month'].astype(str),
+        "Day": dates.dt.day.astype('int32'),
+        "Date": dates.dt.date,
+        "Description": df['Description'].astype(str),
+        "Category": df['Category'].astype(str),
+        "Amount": (df['Amount'] / 100).astype('float32'),
+        "Type": df['Type'].astype(str),
+        "Bank": df['Bank'].astype(str),
+        "Card": df['Card'].astype(str),
+    }
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=SCHEMA, preserve_index=False)
+
+@stage("write_parquet_dataset")
+def write_parquet_dataset(df, dataset_dir, run_id=None):
+    """
+    Append the clean transactions to the Parquet dataset, one folder per Year and Month.
+
+    Args:
+        df (DataFrame): The clean transactions of this run.
+        dataset_dir (str): Path to the Parquet dataset folder.
+        run_id (int): ID of the run, so a resumed run overwrites the files it already wrote.
+    """
+    if pa is None:
+        print("pyarrow is not installed, skipping the Parquet dataset")
+        return
+    if df.empty:
+        return
+
+    # Every run adds its own files to the partitions so earlier runs are kept
+    os.makedirs(dataset_dir, exist_ok=True)
+    ds.write_dataset(
+        to_arrow_table(df),
+        dataset_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{run_id or time.time_ns()}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
@@ -0,0 +1,278 @@
+"""
+Author: Adrien Protzel
+
+This module collects the descriptions that the description and category maps could not resolve
+and shows them in a single review window, instead of one blocking window per row.
+
+The cleaning stages first match every row automatically and only add their unmatched
+descriptions to the queue, once per unique description. When the queue is reviewed, every
+description is listed with an example transaction and the number of rows it covers, and its true
+description is prefilled with the best suggestion of the similarity index. The answers
+are added to the map store in one batch per map and applied back to every row of each reviewed
+description at once. Descriptions that are left empty keep their description, and rows still
+without a category use their description as the category, as before.
+
+Modules used:
+- pandas: For data manipulation and analysis.
+- tkinter: For creating the GUI.
+
+Functions:
+- example_rows(rows): Returns the first row and row count of every unique description.
+- show_review_window(description_items, category_items, suggestions): Shows the review window and returns the answers.
+- apply_answers(df, description_answers, category_answers, categorize): Adds the answers to the map store and applies them to the dataframe.
+
+Classes:
+- ReviewQueue: The unmatched descriptions of a run, reviewed together.
+"""
+
+import pandas as pd
+from map_store import DESCRIPTION_MAP, CATEGORY_MAP, add_rules, get_keyword_map
+from instrumentation import stage, count
+from transaction_schema import format_date, format_amount
+
+# Categories offered in the review window
+CATEGORIES = ["Grocery", "Dining", "Shopping", "Expense", "Subscription", "Utility", "Travel", "Gas", "Transfer"]
+
+def example_rows(rows):
+    """
+    Return the first row and the row count of every unique description.
+
+    Args:
+        rows (DataFrame): Rows with a Description column.
+
+    Returns:
+        dict: Description mapped to its first row (Series) and its number of rows, in order of first appearance.
+    """
+    first_rows = rows.drop_duplicates('Description')
+    counts = rows['Description'].value_counts()
+    return {row['Description']: (row, int(counts[row['Description']])) for _, row in first_rows.iterrows()}
+
+class ReviewQueue:
+    """
+    The descriptions of a run that need a description or a category mapping, each listed once.
+    """
+
+    def __init__(self, interactive=True):
+        """
+        Start an empty queue.
+
+        Args:
+            interactive (bool): Show the review window. Otherwise the queued descriptions are
+                skipped, as if Skip All was pressed.
+        """
+        self.interactive = interactive
+        self.descriptions = {}
+        self.categories = {}
+        # Suggested true descriptions of the queued descriptions, from the similarity index
+        self.suggestions = {}
+        # Whether the category stage has run, so the Category column is filled in after the review
+        self.categorized = False
+
+    def __len__(self):
+        return len(self.descriptions) + len(self.categories)
+
+    def add_descriptions(self, rows, suggestions=None):
+        """
+        Queue the rows whose description did not match the description map.
+
+        Args:
+            rows (DataFrame): The unmatched rows.
+            suggestions (dict): Descriptions mapped to their suggestions as (true description, entry text, score).
+        """
+        for description, item in example_rows(rows).items():
+            if description not in self.descriptions:
+                self.descriptions[description] = item
+        self.suggestions.update(suggestions or {})
+
+    def add_categories(self, rows):
+        """Queue the rows whose description did not match the category map."""
+        self.categorized = True
+        for description, item in example_rows(rows).items():
+            if description not in self.categories:
+                self.categories[description] = item
+
+    @stage("review")
+    def review(self, df):
+        """
+        Review every queued description in one window and apply the answers to the dataframe.
+
+        Args:
+            df (DataFrame): The transactions the queued rows came from.
+
+        Returns:
+            DataFrame: The transactions with the reviewed descriptions and categories.
+        """
+        # Descriptions that also need a description mapping are categorized in the same row
+        category_items = {description: item for description, item in self.categories.items()
+                          if description not in self.descriptions}
+        description_answers, category_answers = [], {}
+        if not self.interactive:
+            count("unreviewed_descriptions", len(self.descriptions) + len(category_items))
+        elif len(self.descriptions) + len(category_items):
+            description_answers, category_answers = show_review_window(self.descriptions, category_items, self.suggestions)
+        count("reviewed_descriptions", len(description_answers) + len(category_answers))
+
+        categorize = self.categorized
+        self.descriptions.clear()
+        self.categories.clear()
+        self.suggestions.clear()
+        self.categorized = False
+        return apply_answers(df, description_answers, category_answers, categorize)
+
+def show_review_window(description_items, category_items, suggestions=None):
+    """
+    Show every queued description in one scrollable window and collect the answers.
+
+    The true description of every description is prefilled with its best suggestion, and the
+    other suggestions are listed below it.
+
+    Args:
+        description_items (dict): Descriptions without a description mapping, with their example row and count.
+        category_items (dict): Descriptions without a category mapping, with their example row and count.
+        suggestions (dict): Descriptions mapped to their suggestions as (true description, entry text, score).
+
+    Returns:
+        tuple: The description answers as (description, keyword, true description) and the
+        category answers as a dictionary of description to category.
+    """
+    # Tk is only imported once the window is shown, so the pipeline also runs on a server without it
+    import tkinter as tk
+
+    description_entries = []
+    category_vars = {}
+    answers = ([], {})
+
+    def cancel():
+        root.destroy()
+        raise SystemExit
+
+    def skip():
+        root.destroy()
+
+    def save(event=None):
+        for description, keyword_entry, true_description_entry in description_entries:
+            keyword = keyword_entry.get().lower()
+            true_description = true_description_entry.get().lower()
+            if keyword and true_description:
+                answers[0].append((description, keyword, true_description))
+        for description, category_var in category_vars.items():
+            if category_var.get():
+                answers[1][description] = category_var.get().lower()
+        root.destroy()
+
+    root = tk.Tk()
+    root.title("Review Unmatched Descriptions")
+
+    # Center the window on the screen
+    width, height = 700, 600
+    root.update_idletasks()
+    x = (root.winfo_screenwidth() // 2) - (width // 2)
+    y = (root.winfo_screenheight() // 2) - (height // 2)
+    root.geometry(f'{width}x{height}+{x}+{y}')
+
+    tk.Label(root, text=f"{len(description_items) + len(category_items)} descriptions need a mapping. "
+                        "Leave a row empty to skip it.").pack(pady=5)
+
+    # Scrollable list of descriptions
+    list_frame = tk.Frame(root)
+    list_frame.pack(fill='both', expand=True)
+    canvas = tk.Canvas(list_frame)
+    scrollbar = tk.Scrollbar(list_frame, orient='vertical', command=canvas.yview)
+    items_frame = tk.Frame(canvas)
+    items_frame.bind('<Configure>', lambda event: canvas.configure(scrollregion=canvas.bbox('all')))
+    canvas.create_window((0, 0), window=items_frame, anchor='nw')
+    canvas.configure(yscrollcommand=scrollbar.set)
+    canvas.pack(side='left', fill='both', expand=True)
+    scrollbar.pack(side='right', fill='y')
+
+    def add_item(description, row, rows, needs_description):
+        item_frame = tk.Frame(items_frame, borderwidth=1, relief='groove')
+        item_frame.pack(fill='x', padx=5, pady=5)
+        tk.Label(item_frame, text=f"{format_date(row['Date'])}: {row['Card']}: {format_amount(row['Amount'])} ({rows} rows)").grid(row=0, column=0, columnspan=2, sticky='w')
+        tk.Label(item_frame, text=description, wraplength=640, justify='left').grid(row=1, column=0, columnspan=2, sticky='w')
+
+        if needs_description:
+            tk.Label(item_frame, text="Description Keyword:").grid(row=2, column=0, sticky='e')
+            keyword_entry = tk.Entry(item_frame, width=40)
+            keyword_entry.grid(row=2, column=1, sticky='w')
+            keyword_entry.insert(0, description)  # Prefill with the current description
+            tk.Label(item_frame, text="True Description:").grid(row=3, column=0, sticky='e')
+            true_description_entry = tk.Entry(item_frame, width=40)
+            true_description_entry.grid(row=3, column=1, sticky='w')
+            candidates = (suggestions or {}).get(description) or []
+            if candidates:
+                true_description_entry.insert(0, candidates[0][0])  # Prefill with the best suggestion
+                tk.Label(item_frame, text="Suggestions: " + ", ".join(f"{value} ({score:.0%})" for value, _, score in candidates),
+                         wraplength=640, justify='left').grid(row=5, column=0, columnspan=2, sticky='w')
+            description_entries.append((description, keyword_entry, true_description_entry))
+
+        category_var = tk.StringVar(item_frame, value="")
+        tk.Label(item_frame, text="Category:").grid(row=4, column=0, sticky='e')
+        tk.OptionMenu(item_frame, category_var, "", *CATEGORIES).grid(row=4, column=1, sticky='w')
+        category_vars[description] = category_var
+
+    for description, (row, rows) in description_items.items():
+        add_item(description, row, rows, needs_description=True)
+    for description, (row, rows) in category_items.items():
+        add_item(description, row, rows, needs_description=False)
+
+    button_frame = tk.Frame(root)
+    button_frame.pack(pady=10)
+
+    cancel_button = tk.Button(button_frame, text="Cancel", command=cancel)
+    cancel_button.grid(row=0, column=0, padx=(0, 20))  # Add space between Cancel and Skip button
+
+    skip_button = tk.Button(button_frame, text="Skip All", command=skip)
+    skip_button.grid(row=0, column=1, padx=(0, 20))  # Add space between Skip and Save button
+
+    save_button = tk.Button(button_frame, text="Save", command=save)
+    save_button.grid(row=0, column=2)
+
+    root.bind('<Return>', save)  # Bind the Enter key to the save function
+
+    root.mainloop()
+    return answers
+
+def apply_answers(df, description_answers, category_answers, categorize=True):
+    """
+    Add the review answers to the map store and apply them to every row of each reviewed description.
+
+    Args:
+        df (DataFrame): The transactions.
+        description_answers (list): Tuples of description, keyword and true description.
+        category_answers (dict): Descriptions mapped to their category.
+        categorize (bool): Fill in the Category of the rows without one, and of the rows whose description changed.
+
+    Returns:
+        DataFrame: The transactions with the reviewed descriptions and categories.
+    """
+    # The category of a reviewed description is stored for its true description
+    true_descriptions = {description: true_description for description, _, true_description in description_answers}
+    add_rules(DESCRIPTION_MAP, [(keyword, true_description) for _, keyword, true_description in description_answers])
+    add_rules(CATEGORY_MAP, [(true_descriptions.get(description, description), category)
+                             for description, category in category_answers.items()])
+
+    # Match the reviewed descriptions again with the new rules, once per unique description
+    if true_descriptions:
+        description_map = get_keyword_map(DESCRIPTION_MAP)
+        reviewed = df['Description'].isin(list(true_descriptions))
+        replacements = {description: description_map.lookup(description, match_values=True) or description
+                        for description in df.loc[reviewed, 'Description'].unique()}
+        new_descriptions = df.loc[reviewed, 'Description'].map(replacements)
+        changed = reviewed.copy()
+        changed[reviewed] = new_descriptions != df.loc[reviewed, 'Description']
+        df.loc[reviewed, 'Description'] = new_descriptions
+        if categorize:
+            df.loc[changed, 'Category'] = None
+
+    # Categorize the rows that still have no category, falling back to their description
+    if categorize:
+        missing = df['Category'].isna()
+        if missing.any():
+            category_map = get_keyword_map(CATEGORY_MAP)
+            categories = {description: category_map.lookup(description) or description
+                          for description in df.loc[missing, 'Description'].unique()}
+            filled = df['Category'].astype(object)
+            filled[missing] = df.loc[missing, 'Description'].map(categories)
+            df['Category'] = pd.Series(filled, index=df.index, dtype='category')
+    return df
@@ -0,0 +1,157 @@
+"""
+Author: Adrien Protzel
+
+This module suggests true descriptions for the descriptions that no keyphrase of the description
+map matches. It builds a character trigram index over the keyphrases and the true descriptions of
+the map, and scores every unmatched description against all of them at once.
+
+Most unmatched descriptions are a known merchant with a different store number, transaction ID or
+city, so punctuation and every word with a digit in it are dropped before the trigrams are taken.
+Two texts are scored by the Dice coefficient of their trigram sets, 2 * shared / (trigrams of one +
+trigrams of the other), which is 1 for the same text and 0 for texts without a trigram in common. The shared trigrams of
+every description and index entry pair are counted from the inverted index in one pass with numpy,
+so only entries that share at least one trigram with a description are ever scored.
+
+The index is cached by the version of the description map, so it is only rebuilt when rules are
+added.
+
+Modules used:
+- re: For normalizing the descriptions.
+- numpy: For counting the shared trigrams.
+
+Functions:
+- normalize(text): Lowercases a description and drops its punctuation and the words with digits.
+- trigrams(text): Returns the character trigrams of a normalized description.
+- get_similarity_index(store_path): Returns the similarity index of the description map, rebuilding it when the map changes.
+
+Classes:
+- SimilarityIndex: A character trigram index over the keyphrases and true descriptions of a map.
+"""
+
+import re
+import numpy as np
+from map_store import STORE_PATH, DESCRIPTION_MAP, connect, load_rules, map_version, refresh_map
+
+# Descriptions whose best suggestion scores at least this much are replaced without review,
+# set to None to review every unmatched description
+AUTO_ACCEPT_THRESHOLD = 0.9
+
+# Number of suggestions kept for every unmatched description
+TOP_K = 3
+
+def normalize(text):
+    """Lowercase a description and drop its punctuation and every word with a digit, e.g. 'AMZN MKTP*2K3J4' as 'amzn mktp'."""
+    return " ".join(word for word in re.split(r"[^a-z0-9&]+", text.lower()) if word and not re.search(r"\d", word))
+
+def trigrams(text):
+    """Return the character trigrams of a normalized description, with the words padded by spaces."""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SimilarityIndex:
+    """
+    A character trigram index over the keyphrases and true descriptions of a map.
+
+    Every keyphrase is an entry that suggests its true description, and every true description is
+    an entry that suggests itself. Entries with the same normalized text are kept once, the first
+    one in map order.
+    """
+
+    def __init__(self, keyword_map):
+        """
+        Build the inverted index of the map entries.
+
+        Args:
+            keyword_map (dict): Keyphrases mapped to their true descriptions, in map order.
+        """
+        self.texts = []
+        self.values = []
+        seen = set()
+        for text, value in list(keyword_map.items()) + [(value, value) for value in keyword_map.values()]:
+            text = normalize(text)
+            if text and text not in seen:
+                seen.add(text)
+                self.texts.append(text)
+                self.values.append(value)
+
+        # Trigram ids of every entry, flattened, with the entry each trigram belongs to
+        self.vocabulary = {}
+        entry_ids = []
+        trigram_ids = []
+        for entry, text in enumerate(self.texts):
+            for trigram in trigrams(text):
+                trigram_ids.append(self.vocabulary.setdefault(trigram, len(self.vocabulary)))
+                entry_ids.append(entry)
+        trigram_ids = np.array(trigram_ids, dtype=np.int64)
+        entry_ids = np.array(entry_ids, dtype=np.int64)
+        self.sizes = np.bincount(entry_ids, minlength=len(self.texts))
+
+        # Inverted index: the entries of trigram t are postings[offsets[t]:offsets[t + 1]]
+        order = np.argsort(trigram_ids, kind='stable')
+        self.postings = entry_ids[order]
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trigram_ids, minlength=len(self.vocabulary)), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.texts)
+
+    def suggest(self, descriptions, k=TOP_K):
+        """
+        Return the k entries most similar to every description.
+
+        Args:
+            descriptions (list): Descriptions to find suggestions for.
+            k (int): Number of suggestions per description.
+
+        Returns:
+            list: For every description, a list of (true description, entry text, score) with the best score first.
+        """
+        # Known trigrams of every description, flattened, with the description each belongs to
+        query_ids = []
+        trigram_ids = []
+        query_sizes = np.zeros(len(descriptions), dtype=np.int64)
+        for query, description in enumerate(descriptions):
+            grams = trigrams(normalize(description))
+            query_sizes[query] = len(grams)
+            for trigram in grams:
+                if trigram in self.vocabulary:
+                    trigram_ids.append(self.vocabulary[trigram])
+                    query_ids.append(query)
+        suggestions = [[] for _ in descriptions]
+        if not trigram_ids:
+            return suggestions
+        trigram_ids = np.array(trigram_ids, dtype=np.int64)
+        query_ids = np.array(query_ids, dtype=np.int64)
+
+        # Expand every (description, trigram) into the postings of the trigram
+        starts = self.offsets[trigram_ids]
+        lengths = self.offsets[trigram_ids + 1] - starts
+        pair_queries = np.repeat(query_ids, lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        pair_entries = self.postings[positions]
+
+        # Shared trigrams of every (description, entry) pair and their Dice coefficient
+        pairs, shared = np.unique(pair_queries * len(self.texts) + pair_entries, return_counts=True)
+        queries, entries = np.divmod(pairs, len(self.texts))
+        scores = 2 * shared / (query_sizes[queries] + self.sizes[entries])
+
+        # Best scores first within every description, ties in map order
+        order = np.lexsort((entries, -scores, queries))
+        ranks = np.arange(len(order)) - np.searchsorted(queries[order], queries[order])
+        for index in order[ranks < k]:
+            entry = entries[index]
+            suggestions[queries[index]].append((self.values[entry], self.texts[entry], round(float(scores[index]), 4)))
+        return suggestions
+
+# Similarity indexes by database, with the description map version they were built from
+_indexes = {}
+
+def get_similarity_index(store_path=STORE_PATH):
+    """Return the similarity index of the description map, rebuilding it only when rules have been added."""
+    refresh_map(DESCRIPTION_MAP, store_path)
+    version = map_version(connect(store_path), DESCRIPTION_MAP)
+    cached = _indexes.get(store_path)
+    if cached is None or cached[0] != version:
+        cached = (version, SimilarityIndex(load_rules(DESCRIPTION_MAP, store_path)))
+        _indexes[store_path] = cached
+    return cached[1]
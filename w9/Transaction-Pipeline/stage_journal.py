@@ -0,0 +1,148 @@
+"""
+Author: Adrien Protzel
+
+This module keeps a journal of the pipeline stages of a run, so a run that fails or is cancelled
+halfway through can be resumed from its last completed stage instead of importing and cleaning
+everything again.
+
+The journal is a JSON file in the Data folder that lists the completed stages of the current run.
+The dataframe of the stages that can be resumed from is saved as a checkpoint next to it, and the
+input files of those stages are only removed once their checkpoint is saved. Every file is written
+to a temporary file first and renamed over the old one, so a crash never leaves a half written
+journal, checkpoint or output. When the run finishes, the journal and its checkpoints are removed.
+
+Modules used:
+- contextlib: For the atomic write context manager.
+- json: For reading and writing the journal.
+- os: For interacting with the operating system.
+- shutil: For removing the checkpoints.
+- time: For the run ID.
+- pandas: For reading and writing the checkpoints.
+
+Functions:
+- atomic_write(file_path): Context manager that yields a temporary path and renames it over the file once it is written.
+
+Classes:
+- StageJournal: The completed stages and checkpoints of the current run.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+
+# Names of the journal file and the checkpoint folder in the Data folder
+JOURNAL_FILE = 'journal.json'
+CHECKPOINT_DIR = 'checkpoints'
+
+@contextlib.contextmanager
+def atomic_write(file_path):
+    """
+    Yield a temporary path next to the file and rename it over the file once the block succeeds.
+
+    The temporary file is removed if the block fails, so the old file is left as it was.
+
+    Args:
+        file_path (str): Path to the file to write.
+    """
+    temp_path = f"{file_path}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class StageJournal:
+    """
+    The completed stages and checkpoints of the current run, kept in the Data folder.
+    """
+
+    def __init__(self, data_dir):
+        """
+        Load the journal of an unfinished run, or start a new one.
+
+        Args:
+            data_dir (str): Path to the Data folder.
+        """
+        self.journal_path = os.path.join(data_dir, JOURNAL_FILE)
+        self.checkpoint_dir = os.path.join(data_dir, CHECKPOINT_DIR)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                self.journal = json.load(f)
+        else:
+            self.journal = {"run_id": time.time_ns(), "stages": {}}
+
+    @property
+    def run_id(self):
+        """ID of the run, the same when it is resumed."""
+        return self.journal["run_id"]
+
+    @property
+    def resumed(self):
+        """Whether a stage of this run already completed before this process started."""
+        return bool(self.journal["stages"])
+
+    def completed(self, stage):
+        """Return whether a stage of this run has completed."""
+        return self.journal["stages"].get(stage, {}).get("completed", False)
+
+    def info(self, stage):
+        """Return what was recorded when the stage started, e.g. the size of clean.csv."""
+        return self.journal["stages"].get(stage, {})
+
+    def save(self):
+        """Write the journal through a temporary file."""
+        with atomic_write(self.journal_path) as temp_path:
+            with open(temp_path, 'w') as f:
+                json.dump(self.journal, f, indent=4)
+
+    def start(self, stage, **info):
+        """Record that a stage has started, with what is needed to undo a partial run of it."""
+        self.journal["stages"][stage] = dict(info, completed=False)
+        self.save()
+
+    def complete(self, stage, df=None):
+        """
+        Record that a stage has completed, saving its dataframe as a checkpoint if one is given.
+
+        Args:
+            stage (str): Name of the stage.
+            df (DataFrame): Result of the stage to resume from, or None.
+        """
+        entry = self.journal["stages"].setdefault(stage, {})
+        if df is not None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            checkpoint_path = os.path.join(self.checkpoint_dir, f"{stage}.pkl")
+            with atomic_write(checkpoint_path) as temp_path:
+                df.to_pickle(temp_path, compression=None)
+            entry["checkpoint"] = os.path.basename(checkpoint_path)
+        entry["completed"] = True
+        self.save()
+
+    def resume(self, stages):
+        """
+        Return where to resume a list of stages from.
+
+        Args:
+            stages (list): Names of the stages, in order.
+
+        Returns:
+            tuple: The index of the first stage to run and the checkpoint to start it with, or (0, None).
+        """
+        for index in range(len(stages) - 1, -1, -1):
+            entry = self.journal["stages"].get(stages[index], {})
+            if entry.get("completed") and entry.get("checkpoint"):
+                checkpoint_path = os.path.join(self.checkpoint_dir, entry["checkpoint"])
+                if os.path.exists(checkpoint_path):
+                    return index + 1, pd.read_pickle(checkpoint_path, compression=None)
+        return 0, None
+
+    def finish(self):
+        """Remove the journal and the checkpoints once the run has finished."""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal = {"run_id": time.time_ns(), "stages": {}}
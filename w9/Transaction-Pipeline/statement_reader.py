@@ -0,0 +1,142 @@
+"""
+Author: Adrien Protzel
+
+This module opens a statement file for reading from its first data row, without reading the
+preamble into Python or copying the file.
+
+The file is memory mapped, and the preamble rows given by remove_rows in config.json are skipped
+by searching the mapping for line ends, so finding the first data row costs one scan over the
+preamble bytes only. The rows after it are read straight from the mapping by the CSV reader, in
+small chunks, so a statement of any size is read with one sequential pass and constant memory.
+
+Before the preamble is skipped, the format of the file is sniffed from its first bytes: a UTF-8
+byte order mark is skipped, and files that end their lines with a bare carriage return (old Mac
+exports) are split on it instead of on the newline.
+
+Modules used:
+- contextlib: For closing the mapping after the file is read.
+- io: For reading the mapping as a text stream.
+- mmap: For mapping the statement file into memory.
+
+Functions:
+- sniff_format(view): Returns the offset after the byte order mark, the line end and the encoding of a file.
+- find_data_offset(view, start, remove_rows, line_end): Returns the byte offset of the first row after the preamble.
+- open_statement(file_path, remove_rows): Opens a statement as a text stream starting at its first data row.
+
+Classes:
+- MappedStream: A raw binary stream over a part of a memory mapped file.
+"""
+
+import contextlib
+import io
+import mmap
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+# Number of bytes searched for the first line end when sniffing the format
+SNIFF_BYTES = 64 * 1024
+
+def sniff_format(view):
+    """
+    Sniff the format of a statement from its first bytes.
+
+    Args:
+        view (mmap): The mapped statement file.
+
+    Returns:
+        tuple: The offset after the byte order mark, the line end (b'\\n' or b'\\r') and the
+        encoding, None for the default encoding of open().
+    """
+    start = 0
+    encoding = None
+    if view[:len(UTF8_BOM)] == UTF8_BOM:
+        start = len(UTF8_BOM)
+        encoding = 'utf-8'
+
+    # \r\n lines are found by their \n, only files without any \n end their lines with \r
+    head = view[start:start + SNIFF_BYTES]
+    line_end = b'\r' if b'\n' not in head and b'\r' in head else b'\n'
+    return start, line_end, encoding
+
+def find_data_offset(view, start, remove_rows, line_end=b'\n'):
+    """
+    Return the byte offset of the first row after the preamble.
+
+    Args:
+        view (mmap): The mapped statement file.
+        start (int): Offset of the first row of the file.
+        remove_rows (int): Number of rows to skip from the top of the file.
+        line_end (bytes): The line end of the file.
+
+    Returns:
+        int: The offset of the first data row, the end of the file if the preamble is the whole file.
+    """
+    offset = start
+    for _ in range(remove_rows):
+        offset = view.find(line_end, offset)
+        if offset == -1:
+            return len(view)
+        offset += len(line_end)
+    return offset
+
+class MappedStream(io.RawIOBase):
+    """
+    A raw binary stream over a part of a memory mapped file.
+
+    Reads are copied from the mapping into the buffer of the reader, so no other copy of the
+    file is ever made.
+    """
+
+    def __init__(self, view, offset):
+        """
+        Args:
+            view (mmap): The mapped file.
+            offset (int): Offset the stream starts at.
+        """
+        self.view = memoryview(view)
+        self.position = offset
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """Copy the next bytes of the mapping into the buffer and return how many were copied."""
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        """Release the view of the mapping, so the mapping itself can be closed."""
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+@contextlib.contextmanager
+def open_statement(file_path, remove_rows=0):
+    """
+    Open a statement as a text stream starting at its first data row, for csv.reader.
+
+    Args:
+        file_path (Path): Path to the statement file.
+        remove_rows (int): Number of preamble rows to skip from the top of the file.
+
+    Yields:
+        TextIOWrapper: The rows of the statement after the preamble.
+    """
+    with open(file_path, 'rb') as f:
+        # Empty files cannot be mapped, and have no rows to read
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield io.StringIO()
+            return
+
+        try:
+            start, line_end, encoding = sniff_format(view)
+            offset = find_data_offset(view, start, remove_rows, line_end)
+            # newline='' hands the line ends to csv.reader, which keeps quoted line breaks intact
+            with io.TextIOWrapper(io.BufferedReader(MappedStream(view, offset)), encoding=encoding, newline='') as stream:
+                yield stream
+        finally:
+            view.close()
@@ -0,0 +1,58 @@
+"""
+Author: Adrien Protzel
+
+This module checks that a journaled run gets through the merging stage, since the journal is a
+JSON file in the Data folder next to the JSON statements that file_merger.py converts.
+
+Usage:
+    python -m pytest test_stage_journal.py
+
+Modules used:
+- os: For interacting with the operating system.
+- tempfile: For the temporary Data folder.
+- unittest: For the test case.
+"""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+import file_merger
+from config_registry import get_registry, folder_name
+from stage_journal import StageJournal, JOURNAL_FILE
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+class JournaledMergeTest(unittest.TestCase):
+    """A run whose file_importer stage is in the journal, merged like main.run_pipeline does."""
+
+    def test_merge_keeps_journal(self):
+        configs = get_registry(os.path.join(current_dir, 'Configs', 'config.json'))
+        config = next(iter(configs))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_dir = Path(temp_dir) / 'Data'
+            account_dir = data_dir / folder_name(config)
+            account_dir.mkdir(parents=True)
+            header = [column if column != "*" else f"Column {i}" for i, column in enumerate(config['add_header'])]
+            rows = [{"Date": "01/02/2024", "Description": "COFFEE", "Amount": "-4.50"}.get(column, "x")
+                    for column in config['add_header']]
+            with open(account_dir / 'statement.csv', 'w') as f:
+                for line in range(config['remove_rows'] - 1):
+                    f.write(f"Summary line {line}\n")
+                if config['remove_rows'] > 0:
+                    f.write(','.join(header) + '\n')
+                f.write(','.join(rows) + '\n')
+
+            journal = StageJournal(str(data_dir))
+            journal.complete("file_importer")
+
+            file_merger.convert_json_files(data_dir)
+            file_merger.merge_accounts(data_dir, configs)
+
+            self.assertFalse((data_dir / 'journal.csv').exists())
+            self.assertTrue(StageJournal(str(data_dir)).completed("file_importer"))
+            self.assertTrue((data_dir / JOURNAL_FILE).exists())
+            self.assertTrue((account_dir / f"{folder_name(config)}.csv").exists())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+"""
+Author: Adrien Protzel
+
+This module declares the column types of the transaction dataframe, so every stage reads and
+writes the same types instead of inferring them from scratch.
+
+The low cardinality columns (Month, Category, Type, Bank, Card) are categoricals, Year is a small
+integer, Date is a datetime and Amount is an integer number of cents. Dates are written back in the
+month/day/year format of the statements and amounts with two decimals, only when a file is written.
+
+Date strings are parsed once per distinct value, since a statement history repeats the same few
+hundred dates over many rows, and Year, Month and Day are derived from the parsed dates as whole
+columns, with the month names taken from a fixed lookup table.
+
+Modules used:
+- calendar: For the month names.
+- decimal: For writing numeric amounts as decimal text.
+- numpy: For mapping the parsed dates back to every row.
+- pandas: For data manipulation and analysis.
+
+Functions:
+- parse_amounts(amounts): Parses amounts as written in the bank exports into integer cents.
+- format_amounts(cents): Formats integer cents as amounts with two decimals.
+- format_amount(cents): Formats a single amount in cents for display.
+- parse_dates(dates): Parses date strings, each distinct value once.
+- derive_date_columns(df, day): Parses the Date column and fills in Year, Month and optionally Day.
+- apply_schema(df): Converts the columns of a dataframe to the schema types.
+- read_transactions(file_path): Reads a transaction CSV file with the schema types.
+- write_transactions(df, file_path, **kwargs): Writes a transaction dataframe to CSV with the statement date format.
+- format_date(value): Formats a single date for display.
+"""
+
+import calendar
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from stage_journal import atomic_write
+
+# Columns of dirty.csv and clean.csv, in file order
+CLEAN_HEADER = ["Year", "Month", "Date", "Description", "Category", "Amount", "Type", "Bank", "Card"]
+
+# Date format of the statements and of clean.csv
+DATE_FORMAT = '%m/%d/%Y'
+
+# Month names in calendar order, so sorting by Month sorts by date
+MONTH_DTYPE = pd.CategoricalDtype(list(calendar.month_name)[1:], ordered=True)
+
+# Column types of the transaction dataframe, Date is parsed separately with DATE_FORMAT
+DTYPES = {
+    "Year": "Int16",
+    "Month": MONTH_DTYPE,
+    "Description": "str",
+    "Category": "category",
+    "Amount": "Int64",
+    "Type": "category",
+    "Bank": "category",
+    "Card": "category",
+}
+
+def parse_amounts(amounts):
+    """
+    Parse amounts as written in the bank exports into integer cents, e.g. $1,301.03, (25.00) or 25.00-.
+
+    Amounts in parentheses, or with a leading or trailing minus, are negative. A sign anywhere
+    else makes the amount invalid. Digits after the cents are rounded half up.
+
+    Args:
+        amounts (Series): Amount strings, or amounts that are already numbers of dollars.
+
+    Returns:
+        Series: The amounts in cents, <NA> where the amount is missing or not a number.
+    """
+    # Numbers are written as their shortest decimal text, so they are rounded half up like the strings
+    # instead of picking up the float error of multiplying by 100, e.g. 1.005 is 101 cents
+    if pd.api.types.is_numeric_dtype(amounts):
+        amounts = amounts.map(lambda value: None if pd.isna(value) else format(Decimal(str(value)), 'f'))
+
+    text = amounts.astype('string').str.replace(r'[\s$,]', '', regex=True)
+    # A sign is only accepted at one end, or as parentheses around the whole amount, so "1-2" is not 12.00
+    signed = text.str.fullmatch(r'\([\d.]*\)|[+-]?[\d.]*|[\d.]*[+-]')
+    negative = text.str.contains(r'^\(|^-|-$', regex=True)
+    parts = text.str.replace(r'[()+-]', '', regex=True).str.extract(r'^(\d*)(?:\.(\d*))?$')
+    valid = signed & (parts[0].str.len().gt(0) | parts[1].str.len().gt(0))
+
+    # Whole dollars, then the first two decimals as cents and the third to round them
+    decimals = parts[1].fillna('').str.ljust(3, '0')
+    dollars = pd.to_numeric(parts[0].replace('', '0'), errors='coerce').astype(DTYPES['Amount'])
+    cents = pd.to_numeric(decimals.str[:2], errors='coerce').astype(DTYPES['Amount'])
+    rounding = decimals.str[2].ge('5').astype(DTYPES['Amount'])
+    total = dollars * 100 + cents + rounding
+
+    total = total.where(~negative.fillna(False), -total)
+    return total.where(valid.fillna(False)).astype(DTYPES['Amount'])
+
+def format_amounts(cents):
+    """Format integer cents as amounts with two decimals, e.g. -130103 as -1301.03."""
+    sign = np.where(cents.lt(0).fillna(False), '-', '')
+    magnitude = cents.abs()
+    text = sign + (magnitude // 100).astype('string') + '.' + (magnitude % 100).astype('string').str.zfill(2)
+    return pd.Series(text, index=cents.index, name=cents.name).astype(object).where(cents.notna(), None)
+
+def format_amount(cents):
+    """Format a single amount in cents for display, e.g. in the manual input windows."""
+    if pd.isna(cents):
+        return ""
+    return f"{'-' if cents < 0 else ''}{abs(int(cents)) // 100}.{abs(int(cents)) % 100:02d}"
+
+def parse_dates(dates):
+    """
+    Parse date strings in the statement format, each distinct value once.
+
+    Args:
+        dates (Series): Date strings, or dates that are already parsed.
+
+    Returns:
+        Series: The parsed dates, NaT where the date is missing.
+    """
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+
+    # Parse the distinct strings only, missing dates get code -1 which picks the trailing NaT
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=DATE_FORMAT).to_numpy()
+    parsed = np.append(parsed, np.datetime64('NaT', 'ns').astype(parsed.dtype))
+    return pd.Series(parsed[codes], index=dates.index, name=dates.name)
+
+def derive_date_columns(df, day=False):
+    """
+    Parse the Date column and fill in Year, Month and optionally Day from it.
+
+    Args:
+        df (DataFrame): Transactions with a Date column.
+        day (bool): Also add a Day column with the day of the month.
+
+    Returns:
+        DataFrame: The same dataframe with the parsed Date and the derived columns.
+    """
+    df['Date'] = parse_dates(df['Date'])
+    dates = df['Date'].dt
+    df['Year'] = dates.year.astype(DTYPES['Year'])
+
+    # Month numbers index the month names of MONTH_DTYPE, missing dates get code -1
+    month_codes = dates.month.fillna(0).astype('int8') - 1
+    df['Month'] = pd.Categorical.from_codes(month_codes, dtype=MONTH_DTYPE)
+    if day:
+        df['Day'] = dates.day.astype('Int8')
+    return df
+
+def apply_schema(df):
+    """
+    Convert the columns of a dataframe to the schema types, leaving columns outside the schema as they are.
+
+    Args:
+        df (DataFrame): Transactions with any of the schema columns.
+
+    Returns:
+        DataFrame: The same dataframe with the schema types.
+    """
+    if 'Date' in df.columns:
+        df['Date'] = parse_dates(df['Date'])
+    if 'Amount' in df.columns and not pd.api.types.is_integer_dtype(df['Amount']):
+        df['Amount'] = parse_amounts(df['Amount'])
+    for column, dtype in DTYPES.items():
+        if column in df.columns and df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def read_transactions(file_path):
+    """Read a transaction CSV file (dirty.csv, clean.csv) with the schema types."""
+    columns = pd.read_csv(file_path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in DTYPES.items() if column in columns}
+
+    # Dates and amounts are read as text and parsed by apply_schema
+    dtypes['Date'] = 'str'
+    dtypes['Amount'] = 'str'
+    return apply_schema(pd.read_csv(file_path, dtype=dtypes))
+
+def write_transactions(df, file_path, **kwargs):
+    """
+    Write a transaction dataframe to CSV, with the dates in the statement format and the amounts
+    with two decimals. A new file replaces the old one only once it is completely written.
+
+    Args:
+        df (DataFrame): Transactions to write.
+        file_path (str): Path to the CSV file.
+        **kwargs: Further arguments for DataFrame.to_csv, e.g. mode and header.
+    """
+    if 'Amount' in df.columns and pd.api.types.is_integer_dtype(df['Amount']):
+        df = df.assign(Amount=format_amounts(df['Amount']))
+
+    # Appends go straight to the file, a new file is written through a temporary file
+    if kwargs.get('mode', 'w') != 'w':
+        df.to_csv(file_path, index=False, date_format=DATE_FORMAT, **kwargs)
+        return
+    with atomic_write(file_path) as temp_path:
+        df.to_csv(temp_path, index=False, date_format=DATE_FORMAT, **kwargs)
+
+def format_date(value):
+    """Format a single date for display, e.g. in the manual input windows."""
+    if pd.isna(value):
+        return ""
+    if isinstance(value, str):
+        return value
+    return value.strftime(DATE_FORMAT)
@@ -0,0 +1,342 @@
+"""
+Author: Adrien Protzel
+
+This script watches an inbox folder and imports the statements that land in it without any
+window, so the export jobs can drop statements on a server without a desktop session.
+
+Every new file is moved to the Data folder of its account and the pipeline is run on it. The
+account of a file is the inbox subfolder it lands in, e.g. Inbox/Credit_Chase_Freedom/, or for a
+file dropped straight into the inbox, the start of its name, e.g. "Credit Chase Freedom.CSV", or
+else the single account whose format its first lines match (see format_detector.py). Files without
+an account, or whose format fits several accounts, are moved to Inbox/Unrouted. A burst of files is collected into a single
+run: the pipeline only starts once no file has arrived or changed for DEBOUNCE_SECONDS.
+
+On Linux the inbox is watched with inotify, elsewhere (or when inotify is not available) it is
+scanned every POLL_SECONDS. The pipeline runs without its windows: bad lines that need manual entry
+are kept for the next interactive run and unmatched descriptions are left as they are, the same as
+pressing Skip All in the review window.
+
+Usage:
+    python watch_daemon.py [--inbox PATH] [--debounce SECONDS] [--poll] [--once]
+
+Modules used:
+- argparse: For the command line options.
+- ctypes: For calling inotify.
+- os: For interacting with the operating system.
+- select: For waiting on inotify events.
+- shutil: For moving the files.
+- struct: For reading inotify events.
+- sys: For checking the platform.
+- time: For the debounce and polling intervals.
+
+Functions:
+- inbox_files(inbox_dir): Lists the files waiting in the inbox.
+- route_file(file_path, inbox_dir, configs): Returns the Data folder names of the accounts an inbox file can belong to.
+- move_file(file_path, target_dir): Moves a file to a folder without replacing a file of the same name.
+- route_inbox(inbox_dir, data_dir, configs): Moves every inbox file to the Data folder of its account.
+- process_inbox(inbox_dir, data_dir): Finishes an interrupted run, then routes the inbox and runs the pipeline on it.
+- create_watcher(inbox_dir, poll): Returns an inotify watcher, or a polling watcher if inotify is not available.
+- watch(inbox_dir, data_dir, debounce, poll): Watches the inbox and runs the pipeline after every burst of files.
+- main(): Parses the command line and starts watching.
+
+Classes:
+- PollingWatcher: Detects changes in the inbox by scanning it at an interval.
+- InotifyWatcher: Detects changes in the inbox with inotify.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import struct
+import sys
+import time
+import main as pipeline
+import instrumentation
+from config_registry import get_registry, folder_name
+from format_detector import entry_from_name, detect_format
+from stage_journal import StageJournal
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(current_dir, 'Data')
+INBOX_DIR = os.path.join(current_dir, 'Inbox')
+REPORT_DIR = os.path.join(current_dir, 'Reports')
+
+# Inbox subfolder for the files without an account
+UNROUTED_DIR = 'Unrouted'
+
+# Quiet time after the last arrival before the pipeline runs, and scan interval of the polling watcher
+DEBOUNCE_SECONDS = 5.0
+POLL_SECONDS = 2.0
+
+# Files that are still being downloaded or written
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.crdownload', '.download')
+
+# inotify events of files that arrive or change, and of new subfolders
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+def inbox_files(inbox_dir):
+    """List the files waiting in the inbox and its account subfolders, leaving out partial and unrouted files."""
+    files = []
+    for root, dirs, names in os.walk(inbox_dir):
+        dirs[:] = [name for name in dirs if name != UNROUTED_DIR and not name.startswith('.')]
+        for name in names:
+            if not name.startswith('.') and not name.lower().endswith(PARTIAL_SUFFIXES):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+def route_file(file_path, inbox_dir, configs):
+    """
+    Return the Data folder names of the accounts an inbox file can belong to.
+
+    Args:
+        file_path (str): Path to the file in the inbox.
+        inbox_dir (str): Path to the inbox.
+        configs (ConfigRegistry): Configuration entries from config.json.
+
+    Returns:
+        list: One folder name for a routed file, several for a file whose format fits several
+        accounts, and none for a file without an account.
+    """
+    # A file in an account subfolder belongs to that account
+    relative = os.path.relpath(file_path, inbox_dir)
+    parts = relative.split(os.sep)
+    if len(parts) > 1:
+        folder = parts[0].replace(' ', '_')
+        return [folder] if configs.folder(folder) is not None else []
+
+    # Otherwise the name has to start with the account, e.g. "Credit Chase Freedom.CSV"
+    entry = entry_from_name(parts[0], configs)
+    if entry is not None:
+        return [folder_name(entry)]
+
+    # Or its first lines have to match the format of a single account
+    return [folder_name(entry) for entry in detect_format(file_path, configs)]
+
+def move_file(file_path, target_dir):
+    """Move a file to a folder, adding a number to its name if the folder already has a file with that name."""
+    os.makedirs(target_dir, exist_ok=True)
+    stem, suffix = os.path.splitext(os.path.basename(file_path))
+    target_path = os.path.join(target_dir, stem + suffix)
+    number = 1
+    while os.path.exists(target_path):
+        target_path = os.path.join(target_dir, f"{stem}_{number}{suffix}")
+        number += 1
+    shutil.move(file_path, target_path)
+    return target_path
+
+def route_inbox(inbox_dir, data_dir, configs):
+    """
+    Move every inbox file to the Data folder of its account, and the files without one to Inbox/Unrouted.
+
+    Returns:
+        int: Number of files moved to the Data folder.
+    """
+    routed = 0
+    for file_path in inbox_files(inbox_dir):
+        folders = route_file(file_path, inbox_dir, configs)
+        if len(folders) == 1:
+            move_file(file_path, os.path.join(data_dir, folders[0]))
+            routed += 1
+            continue
+
+        # Ambiguous files are flagged instead of guessed, until they are dropped in an account subfolder
+        target_path = move_file(file_path, os.path.join(inbox_dir, UNROUTED_DIR))
+        if folders:
+            print(f"{file_path} matches the format of {', '.join(folders)}, moved to {target_path}")
+        else:
+            print(f"No account for {file_path}, moved to {target_path}")
+    return routed
+
+def process_inbox(inbox_dir, data_dir):
+    """
+    Finish a run that was interrupted, then move the inbox files to the Data folder and run the pipeline on them.
+
+    The files are only moved between runs, so a run never removes files it did not merge.
+
+    Returns:
+        int: Number of files imported.
+    """
+    configs = get_registry()
+    if StageJournal(data_dir).resumed:
+        pipeline.run_pipeline(data_dir, configs, interactive=False)
+
+    routed = route_inbox(inbox_dir, data_dir, configs)
+    if routed:
+        print(f"Importing {routed} files......")
+        pipeline.run_pipeline(data_dir, configs, interactive=False)
+        report_path = instrumentation.write_report(REPORT_DIR)
+        if report_path:
+            print(f"Run report saved to {report_path}")
+    return routed
+
+class PollingWatcher:
+    """
+    Detects changes in the inbox by scanning the size and modification time of its files at an interval.
+    """
+
+    def __init__(self, inbox_dir, interval=POLL_SECONDS):
+        self.inbox_dir = inbox_dir
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """Return the size and modification time of every inbox file."""
+        state = {}
+        for file_path in inbox_files(self.inbox_dir):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            state[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return state
+
+    def wait(self, timeout=None):
+        """
+        Wait until a file arrives or changes, or the timeout passes.
+
+        Returns:
+            bool: Whether a file arrived or changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if remaining > 0:
+                time.sleep(remaining)
+            snapshot = self.scan()
+            # Files that were moved away are not changes, only new or growing files are
+            changed = any(self.snapshot.get(path) != state for path, state in snapshot.items())
+            self.snapshot = snapshot
+            if changed:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Detects changes in the inbox with inotify, watching every subfolder as it is created.
+    """
+
+    def __init__(self, inbox_dir):
+        """
+        Raises:
+            OSError: If inotify is not available.
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for root, dirs, _ in os.walk(inbox_dir):
+            dirs[:] = [name for name in dirs if name != UNROUTED_DIR]
+            self.add_watch(root)
+
+    def add_watch(self, directory):
+        """Watch a folder for arriving and changing files."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.watches[wd] = directory
+
+    def wait(self, timeout=None):
+        """
+        Wait until a file arrives or changes, or the timeout passes.
+
+        Returns:
+            bool: Whether a file arrived or changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+
+        changed = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            name = os.fsdecode(name)
+            if wd not in self.watches or name == UNROUTED_DIR:
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_watch(os.path.join(self.watches[wd], name))
+                    changed = True
+            elif not name.startswith('.') and not name.lower().endswith(PARTIAL_SUFFIXES):
+                changed = True
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(inbox_dir, poll=False):
+    """Return an inotify watcher on Linux, or a polling watcher if inotify is not available or poll is set."""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(inbox_dir)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), scanning the inbox every {POLL_SECONDS} seconds")
+    return PollingWatcher(inbox_dir)
+
+def watch(inbox_dir=INBOX_DIR, data_dir=DATA_DIR, debounce=DEBOUNCE_SECONDS, poll=False):
+    """
+    Watch the inbox and run the pipeline once no file has arrived or changed for the debounce time.
+
+    Args:
+        inbox_dir (str): Path to the inbox.
+        data_dir (str): Path to the Data folder.
+        debounce (float): Seconds without arrivals before the pipeline runs.
+        poll (bool): Scan the inbox instead of using inotify.
+    """
+    os.makedirs(inbox_dir, exist_ok=True)
+    watcher = create_watcher(inbox_dir, poll)
+    print(f"Watching {inbox_dir}......")
+
+    # Files that arrived while the daemon was stopped are imported after the first quiet period
+    last_arrival = time.monotonic() if inbox_files(inbox_dir) else None
+    try:
+        while True:
+            timeout = None if last_arrival is None else max(0.0, last_arrival + debounce - time.monotonic())
+            if watcher.wait(timeout):
+                last_arrival = time.monotonic()
+            elif last_arrival is not None and time.monotonic() - last_arrival >= debounce:
+                last_arrival = None
+                process_inbox(inbox_dir, data_dir)
+                # Files that arrived during the run start a new quiet period
+                if inbox_files(inbox_dir):
+                    last_arrival = time.monotonic()
+    finally:
+        watcher.close()
+
+def main():
+    """Parse the command line and watch the inbox, or import it once with --once."""
+    parser = argparse.ArgumentParser(description="Import the statements dropped in the inbox without any window.")
+    parser.add_argument("--inbox", default=INBOX_DIR, help="Folder to watch (default: Inbox next to this script)")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, help="Seconds without arrivals before a run")
+    parser.add_argument("--poll", action="store_true", help="Scan the inbox instead of using inotify")
+    parser.add_argument("--once", action="store_true", help="Import the files in the inbox once and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        os.makedirs(args.inbox, exist_ok=True)
+        process_inbox(args.inbox, DATA_DIR)
+    else:
+        watch(args.inbox, DATA_DIR, args.debounce, args.poll)
+
+if __name__ == "__main__":
+    main()